@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+
+import sys
+import glob
+import json
+import time
+import random
+import argparse
+import resource
+import itertools
+import multiprocessing
+
+from graph_utils import *
+from homomorphism_solver import *
+
+
+# instance families, every family is generated from its own seed, so that
+# the same command line always produces the same instances
+def random_instances(n, rnd, no_instances):
+    # G(n, log n / n) into a sparser random graph of half the size
+    for i in range(no_instances):
+        yield make_random_graph(n), make_random_graph(max(3, n // 2))
+
+
+def yes_instances(n, rnd, no_instances):
+    for i in range(no_instances):
+        g = make_random_graph(n)
+        h, phi = make_random_homomorphism(g)
+        yield g, h
+
+
+def odd_cycle_instances(n, rnd, no_instances):
+    # odd cycles are not bipartite
+    yield nx.cycle_graph(n), nx.complete_graph(2)
+
+
+def kneser_graph(n, k):
+    sets = list(itertools.combinations(range(n), k))
+    g = nx.Graph()
+    g.add_nodes_from(range(len(sets)))
+    g.add_edges_from((i, j) for i, j in itertools.combinations(range(len(sets)), 2) if not set(sets[i]) & set(sets[j]))
+    return g
+
+
+def kneser_instances(n, rnd, no_instances):
+    # KG(n, 2) has chromatic number n - 2
+    yield kneser_graph(n, 2), nx.complete_graph(n - 3)
+
+
+def mycielski_instances(n, rnd, no_instances):
+    # the mycielski graph M_n has chromatic number n and no triangles
+    yield nx.mycielski_graph(n), nx.complete_graph(n - 1)
+
+
+def lattice_instances(n, rnd, no_instances):
+    # pairs of small graphs, as make_lattice.py checks them
+    graphs = []
+    for size in range(2, n + 1):
+        keys = list(corpus.iterate_keys(size))
+        if len(keys) == 0:
+            keys = sorted(glob.glob('small_graphs/graph_%d_*.g6' % size), key=lambda key: parse_graph_key(key)[1])
+        graphs += [load_graph(key, compact=True) for key in keys]
+    if len(graphs) == 0:
+        return
+    for i in range(no_instances * 1000):
+        yield rnd.choice(graphs), rnd.choice(graphs)
+
+
+FAMILIES = [
+    ('random-15', random_instances, 15),
+    ('random-20', random_instances, 20),
+    ('random-30', random_instances, 30),
+    ('yes-20', yes_instances, 20),
+    ('yes-40', yes_instances, 40),
+    ('yes-80', yes_instances, 80),
+    ('odd-cycle-1001', odd_cycle_instances, 1001),
+    ('kneser-7-2', kneser_instances, 7),
+    ('mycielski-4', mycielski_instances, 4),
+    ('mycielski-5', mycielski_instances, 5),
+    ('lattice-7', lattice_instances, 7),
+]
+
+
+def run_family(args):
+    name, make_instances, n, seed, no_instances, config = args
+    # the graph generators draw from the global random state
+    random.seed('%s %d' % (name, seed))
+    rnd = random.Random('%s %d' % (name, seed))
+    result = {'instances' : 0, 'yes' : 0, 'time' : 0., 'nodes' : 0, 'backtracks' : 0}
+    for g, h in make_instances(n, rnd, no_instances):
+        start = time.perf_counter()
+        s = Solver(g, h, **config)
+        found = []
+        def stop(soln):
+            found.append(soln)
+            return False
+        s.find_solutions(stopfunc=stop)
+        result['time'] += time.perf_counter() - start
+        result['instances'] += 1
+        result['yes'] += len(found) > 0
+        result['nodes'] += s.no_nodes
+        result['backtracks'] += s.no_backtracks
+    result['maxrss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return name, result
+
+
+def compare(name, result, base, tolerance):
+    # returns the complaints about a family against its baseline
+    complaints = []
+    if result['instances'] != base['instances'] or result['yes'] != base['yes']:
+        complaints.append('answers differ: %d/%d yes, baseline %d/%d' % (result['yes'], result['instances'], base['yes'], base['instances']))
+    for key in ['time', 'nodes', 'backtracks', 'maxrss']:
+        if result[key] > (1. + tolerance) * base[key] and result[key] - base[key] > MIN_DIFFERENCE[key]:
+            complaints.append('%s %.3g, baseline %.3g' % (key, result[key], base[key]))
+    return complaints
+
+
+# differences too small to be reported, noise in time and memory
+MIN_DIFFERENCE = {'time' : 0.05, 'nodes' : 0, 'backtracks' : 0, 'maxrss' : 4096}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run the solver on fixed instance families')
+    parser.add_argument('families', nargs='*', help='families to run (default: all), e.g. random-20 mycielski-5')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the instances')
+    parser.add_argument('--instances', type=int, default=5, help='instances per random family, thousands of pairs for lattice')
+    parser.add_argument('--propagate', action='store_true', help='solve with forward checking')
+    parser.add_argument('--no-bitset', action='store_true', help='solve without the bitset domains')
+    parser.add_argument('--restarts', type=int, default=0, help='restart after this many backtracks, growing by the luby sequence')
+    parser.add_argument('--save', help='write the results to a json file')
+    parser.add_argument('--baseline', help='compare against results written by --save')
+    parser.add_argument('--tolerance', type=float, default=.2, help='relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    families = [f for f in FAMILIES if len(args.families) == 0 or f[0] in args.families]
+    unknown = set(args.families) - set(f[0] for f in FAMILIES)
+    if unknown:
+        parser.error('unknown families: %s' % ' '.join(sorted(unknown)))
+    config = {'propagate' : args.propagate, 'bitset' : not args.no_bitset, 'restarts' : args.restarts}
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if [baseline['seed'], baseline['instances'], baseline['config']] != [args.seed, args.instances, config]:
+            print('warning: baseline was run with seed %d, %d instances, %s' % (baseline['seed'], baseline['instances'], baseline['config']))
+        baseline = baseline['families']
+
+    # every family runs in a fresh process, which makes maxrss its own peak
+    results = {}
+    regressions = 0
+    print('%-14s %9s %5s %9s %12s %12s %9s' % ('family', 'instances', 'yes', 'time', 'nodes', 'backtracks', 'maxrss'))
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        tasks = [(name, make_instances, n, args.seed, args.instances, config) for name, make_instances, n in families]
+        for name, result in pool.imap(run_family, tasks):
+            results[name] = result
+            print('%-14s %9d %5d %8.3fs %12d %12d %7dkB' % (name, result['instances'], result['yes'], result['time'],
+                                                          result['nodes'], result['backtracks'], result['maxrss']), flush=True)
+            if baseline is None or name not in baseline:
+                continue
+            for complaint in compare(name, result, baseline[name], args.tolerance):
+                print('    regression: %s' % complaint)
+                regressions += 1
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump({'seed' : args.seed, 'instances' : args.instances, 'config' : config, 'families' : results}, f, indent=2)
+    if regressions > 0:
+        sys.exit(1)
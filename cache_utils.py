@@ -0,0 +1,76 @@
+import os
+import json
+import sqlite3
+
+from graph_utils import *
+from homomorphism_solver import *
+
+
+class HomomorphismCache:
+    # results of homomorphism searches shared between runs and processes.
+    # pairs are keyed by the canonical forms of both graphs, and witness maps
+    # are stored between canonical labels, so that they apply to every
+    # isomorphic copy of the pair
+    def __init__(self, filename, max_entries=1000000):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(filename, timeout=60, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS results (g TEXT, h TEXT, phi TEXT, used INTEGER, PRIMARY KEY (g, h))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        self.no_stores = 0
+
+    def clock(self):
+        row = self.db.execute('SELECT MAX(used) FROM results').fetchone()
+        return 1 if row[0] is None else row[0] + 1
+
+    def lookup(self, g_form, h_form):
+        # returns (True, phi) for a known pair, phi being None if there is no homomorphism
+        (g_cert, g_labels), (h_cert, h_labels) = g_form, h_form
+        row = self.db.execute('SELECT phi FROM results WHERE g = ? AND h = ?', (g_cert, h_cert)).fetchone()
+        if row is None:
+            return False, None
+        self.db.execute('UPDATE results SET used = ? WHERE g = ? AND h = ?', (self.clock(), g_cert, h_cert))
+        psi = json.loads(row[0])
+        if psi is None:
+            return True, None
+        h_nodes = {label : nd for nd, label in h_labels.items()}
+        return True, [h_nodes[psi[g_labels[x]]] for x in sorted(g_labels)]
+
+    def store(self, g_form, h_form, phi):
+        (g_cert, g_labels), (h_cert, h_labels) = g_form, h_form
+        psi = None
+        if phi is not None:
+            psi = [None] * len(g_labels)
+            for x in sorted(g_labels):
+                psi[g_labels[x]] = h_labels[phi[x]]
+        self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', (g_cert, h_cert, json.dumps(psi), self.clock()))
+        self.no_stores += 1
+        if self.no_stores % 1000 == 0:
+            self.evict()
+
+    def evict(self):
+        # drop the least recently used entries
+        excess = self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0] - self.max_entries
+        if excess > 0:
+            self.db.execute('DELETE FROM results WHERE rowid IN (SELECT rowid FROM results ORDER BY used LIMIT ?)', (excess,))
+
+
+def open_homomorphism_cache():
+    # the cache is used when HOMOMORPHISM_CACHE names its file
+    filename = os.environ.get('HOMOMORPHISM_CACHE')
+    if not filename:
+        return None
+    return HomomorphismCache(filename, int(os.environ.get('HOMOMORPHISM_CACHE_SIZE', 1000000)))
+
+
+def is_homomorphic_cached(results, g, h, **kwargs):
+    # is_homomorphic that goes through the cache when one is open
+    if results is None:
+        return is_homomorphic(g, h, **kwargs)
+    forms = canonical_form(g), canonical_form(h)
+    found, phi = results.lookup(*forms)
+    if not found:
+        phi = is_homomorphic(g, h, **kwargs)
+        results.store(*forms, phi)
+    return phi
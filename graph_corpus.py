@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+
+import os
+import re
+import sys
+import mmap
+import array
+
+import networkx as nx
+
+
+# graphs of McKay's graph<n>c.g6 files are read in place: graph_<n>_<id>
+# names the id-th line of graph<n>c.g6, counting from 1, which is the file
+# generate_small_graphs.py would have written for it
+GRAPH_KEY = re.compile(r'graph_(\d+)_(\d+)(\.g6|\.json)?$')
+
+
+def parse_graph_key(fname):
+    match = GRAPH_KEY.match(os.path.basename(fname))
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+class BitGraph:
+    # undirected graph on 0..n-1, row u holds the neighbours of u as bits
+    __slots__ = ['n', 'rows']
+
+    def __init__(self, n, rows):
+        self.n = n
+        self.rows = rows
+
+    def __len__(self):
+        return self.n
+
+    def nodes(self):
+        return range(self.n)
+
+    def has_edge(self, u, v):
+        return bool((self.rows[u] >> v) & 1)
+
+    def neighbors(self, u):
+        row = self.rows[u]
+        while row:
+            low = row & -row
+            yield low.bit_length() - 1
+            row ^= low
+
+    def degree(self, u):
+        return bin(self.rows[u]).count('1')
+
+    def edges(self):
+        return [(u, v) for u in range(self.n) for v in self.neighbors(u) if u < v]
+
+    def number_of_edges(self):
+        return sum(self.degree(u) for u in range(self.n)) // 2
+
+    def to_networkx(self):
+        g = nx.Graph()
+        g.add_nodes_from(range(self.n))
+        g.add_edges_from(self.edges())
+        return g
+
+
+# optional first line of a graph6 file, networkx writes it by default
+GRAPH6_HEADER = b'>>graph6<<'
+
+
+def decode_graph6(data):
+    data = data.strip()
+    if data.startswith(GRAPH6_HEADER):
+        data = data[len(GRAPH6_HEADER):]
+    data = [x - 63 for x in data]
+    if len(data) == 0 or min(data) < 0 or max(data) > 63:
+        raise ValueError('not a graph6 string')
+    # n takes 1, 4 or 8 bytes
+    if data[0] < 63:
+        digits, data = data[:1], data[1:]
+    elif len(data) >= 4 and data[1] < 63:
+        digits, data = data[1:4], data[4:]
+    elif len(data) >= 8:
+        digits, data = data[2:8], data[8:]
+    else:
+        raise ValueError('not a graph6 string')
+    n = 0
+    for x in digits:
+        n = (n << 6) | x
+    if len(data) != (n * (n - 1) // 2 + 5) // 6:
+        raise ValueError('graph6 string of %d vertices has %d bytes of edges' % (n, len(data)))
+    # 6 bits per byte, the upper triangle column by column
+    bits = 0
+    for x in data:
+        bits = (bits << 6) | x
+    k = 6 * len(data)
+    rows = [0] * n
+    for j in range(1, n):
+        for i in range(j):
+            k -= 1
+            if (bits >> k) & 1:
+                rows[i] |= 1 << j
+                rows[j] |= 1 << i
+    return BitGraph(n, rows)
+
+
+class GraphCorpus:
+    def __init__(self, directory=None):
+        self.directory = os.environ.get('GRAPH_CORPUS', '.') if directory is None else directory
+        self.files = {}
+
+    def corpus_file(self, n):
+        return os.path.join(self.directory, 'graph%dc.g6' % n)
+
+    def open(self, n):
+        # the file is mapped, and the offsets of its lines are kept in a
+        # sidecar index so that it is scanned only once
+        if n not in self.files:
+            fname = self.corpus_file(n)
+            if not os.path.exists(fname) or os.path.getsize(fname) == 0:
+                self.files[n] = None
+                return None
+            with open(fname, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            offsets = self.load_index(fname, len(mm))
+            if offsets is None:
+                offsets = array.array('Q', [0])
+                pos = mm.find(b'\n')
+                while pos != -1:
+                    offsets.append(pos + 1)
+                    pos = mm.find(b'\n', pos + 1)
+                if offsets[-1] != len(mm):
+                    offsets.append(len(mm))
+                self.unload_index(fname, offsets)
+            self.files[n] = (mm, offsets)
+        return self.files[n]
+
+    def load_index(self, fname, size):
+        offsets = array.array('Q')
+        try:
+            with open(fname + '.idx', 'rb') as f:
+                offsets.frombytes(f.read())
+        except (OSError, ValueError):
+            return None
+        if len(offsets) == 0 or offsets[-1] != size:
+            return None
+        return offsets
+
+    def unload_index(self, fname, offsets):
+        tmp_fname = '%s.idx.%d.tmp' % (fname, os.getpid())
+        try:
+            with open(tmp_fname, 'wb') as f:
+                offsets.tofile(f)
+            os.replace(tmp_fname, fname + '.idx')
+        except OSError:
+            # a read-only corpus is scanned by every process
+            pass
+
+    def size(self, n):
+        corpus = self.open(n)
+        return 0 if corpus is None else len(corpus[1]) - 1
+
+    def has_graph(self, fname):
+        key = parse_graph_key(fname)
+        return key is not None and 1 <= key[1] <= self.size(key[0])
+
+    def load_graph6(self, fname):
+        n, index = parse_graph_key(fname)
+        mm, offsets = self.open(n)
+        return mm[offsets[index - 1]:offsets[index]].strip()
+
+    def load(self, fname):
+        return decode_graph6(self.load_graph6(fname))
+
+    def iterate_keys(self, n, prefix='small_graphs/'):
+        for index in range(1, self.size(n) + 1):
+            yield '%sgraph_%d_%d.g6' % (prefix, n, index)
+
+
+corpus = GraphCorpus()
+
+
+if __name__ == '__main__':
+    # print the keys of all graphs of the given sizes, e.g. for make_lattice.py -
+    for n in sys.argv[1:]:
+        for key in corpus.iterate_keys(int(n)):
+            print(key)
@@ -1,13 +1,15 @@
 import os
 import json
 import math
+import hashlib
+import collections
 from random import choice
 from random import randint
 from random import shuffle
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import networkx as nx
 
+from graph_corpus import *
+
 
 def shuffled(lst):
     shuffle(lst)
@@ -21,6 +23,9 @@ def shifted(lst, steps=1):
 
 
 def plot_graphs(Gs, ssizes, filename, **kwargs):
+    # plotting libraries are slow to import and not needed by the solver
+    import matplotlib as mpl
+    import matplotlib.pyplot as plt
     layout = kwargs['layout'] if 'layout' in kwargs else nx.kamada_kawai_layout
     colors = kwargs['colors'] if 'colors' in kwargs else ['r']
     title_font_size = kwargs['title_font_size'] if 'title_font_size' in kwargs else 40
@@ -165,15 +170,28 @@ def deserialize_graph(s):
     return g
 
 
-def load_graph(fname):
+def load_graph(fname, compact=False):
+    # compact: graph6 graphs stay graph_corpus.BitGraph rows, which the solver
+    # compiles directly, instead of becoming networkx graphs
+    if not os.path.exists(fname) and corpus.has_graph(fname):
+        # graphs of the corpus have no file of their own
+        g = corpus.load(fname)
+        return g if compact else g.to_networkx()
     if fname.endswith('.g6'):
+        if compact:
+            with open(fname, 'rb') as f:
+                return decode_graph6(f.read())
         return nx.read_graph6(fname)
     elif not os.path.exists(fname) and fname.endswith('.json'):
-        return load_graph(fname.replace('.json', '.g6'))
+        return load_graph(fname.replace('.json', '.g6'), compact)
     with open(fname, 'r') as f:
         return deserialize_graph(f.read())
 
 
+def as_networkx(g):
+    return g.to_networkx() if isinstance(g, BitGraph) else g
+
+
 def unload_graph(g, fname):
     if fname.endswith('.g6'):
         nx.write_graph6(g, fname, header=False)
@@ -183,6 +201,14 @@ def unload_graph(g, fname):
         json.dump(s, f)
 
 
+def unload_json(j, fname):
+    # write to a temporary file first, so that concurrent readers never see a partial file
+    tmp_fname = '%s.%d.tmp' % (fname, os.getpid())
+    with open(tmp_fname, 'w') as f:
+        json.dump(j, f)
+    os.replace(tmp_fname, fname)
+
+
 def deserialize_digraph(s):
     s = json.loads(s)
     nodes = s['nodes']
@@ -225,3 +251,95 @@ def is_cycle(g):
         if g.degree(nd) != 2:
             return False
     return True
+
+
+def wl_hash(g, iterations=3):
+    # Weisfeiler-Lehman hash; unlike the networkx one it does not change
+    # between versions, so it can be stored
+    labels = {nd : str(g.degree(nd)) for nd in g.nodes()}
+    histogram = []
+    for i in range(iterations):
+        labels = {
+            nd : hashlib.blake2b((labels[nd] + ',' + ','.join(sorted(labels[u] for u in g.neighbors(nd)))).encode(),
+                                 digest_size=8).hexdigest()
+                for nd in g.nodes()
+        }
+        histogram += sorted(labels.values())
+    return hashlib.blake2b(' '.join(histogram).encode(), digest_size=16).hexdigest()
+
+
+def encode_graph6(n, adj):
+    # graph6 string of a graph on 0..n-1 given by its adjacency sets
+    if n < 63:
+        data = [n]
+    else:
+        data = [63, (n >> 12) & 63, (n >> 6) & 63, n & 63]
+    bits = [int(i in adj[j]) for j in range(1, n) for i in range(j)]
+    bits += [0] * (-len(bits) % 6)
+    for k in range(0, len(bits), 6):
+        data += [int(''.join(map(str, bits[k:k + 6])), 2)]
+    return bytes(x + 63 for x in data).decode()
+
+
+def refine_colours(adj, colours):
+    # split colour classes by the colours of the neighbours until the
+    # partition is equitable; new classes are ordered by invariant keys
+    while True:
+        keys = [(colours[v], tuple(sorted(colours[u] for u in adj[v]))) for v in range(len(adj))]
+        ranks = {k : i for i, k in enumerate(sorted(set(keys)))}
+        refined = [ranks[k] for k in keys]
+        if len(ranks) == len(set(colours)):
+            return refined
+        colours = refined
+
+
+def canonical_form(g):
+    # canonical graph6 string and the canonical label of every node, by
+    # individualization-refinement; subtrees that are images of explored
+    # ones under automorphisms found on the way are pruned
+    nodes = sorted(g.nodes())
+    index = {nd : i for i, nd in enumerate(nodes)}
+    n = len(nodes)
+    adj = [set(index[u] for u in g.neighbors(nd)) for nd in nodes]
+    leaves, automorphisms = {}, []
+    best = [None, None]
+
+    def orbit_root(orbits, v):
+        while orbits[v] != v:
+            v = orbits[v]
+        return v
+
+    def search(colours, prefix):
+        colours = refine_colours(adj, colours)
+        if len(set(colours)) == n:
+            inverse = [None] * n
+            for v in range(n):
+                inverse[colours[v]] = v
+            certificate = encode_graph6(n, [set(colours[u] for u in adj[inverse[i]]) for i in range(n)])
+            if certificate in leaves:
+                other = leaves[certificate]
+                automorphisms.append([other[colours[v]] for v in range(n)])
+                return
+            leaves[certificate] = inverse
+            if best[0] is None or certificate < best[0]:
+                best[0], best[1] = certificate, colours
+            return
+        sizes = collections.Counter(colours)
+        target = min(c for c in sizes if sizes[c] > 1 and sizes[c] == min(s for s in sizes.values() if s > 1))
+        explored = []
+        for v in [v for v in range(n) if colours[v] == target]:
+            # orbits of the automorphisms that fix the prefix
+            orbits = list(range(n))
+            for gamma in automorphisms:
+                if all(gamma[w] == w for w in prefix):
+                    for w in range(n):
+                        a, b = orbit_root(orbits, w), orbit_root(orbits, gamma[w])
+                        if a != b:
+                            orbits[max(a, b)] = min(a, b)
+            if any(orbit_root(orbits, v) == orbit_root(orbits, w) for w in explored):
+                continue
+            explored.append(v)
+            search([2 * c + (u != v) for u, c in enumerate(colours)], prefix + [v])
+
+    search([0] * n, [])
+    return best[0], {nd : best[1][index[nd]] for nd in nodes}
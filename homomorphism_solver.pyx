@@ -1,18 +1,241 @@
 #!python
 #cython: language_level=3
-#cython: profile=True
-#cython: linetrace=True
 #distutils: language=c++
 
 
 from random import randint
+from random import Random
 from random import choice
+import array
+import threading
 import networkx as nx
 
+from graph_corpus import decode_graph6
+
 
 from libcpp.vector cimport vector
-from libcpp.set cimport set
+from libcpp.utility cimport pair
+from libcpp.algorithm cimport sort
 from libcpp cimport bool
+from libc.stdint cimport uint64_t
+from posix.time cimport clock_gettime, timespec, CLOCK_MONOTONIC
+
+
+cdef extern from *:
+    int __builtin_ctzll(unsigned long long) nogil
+    int __builtin_popcountll(unsigned long long) nogil
+
+
+cdef inline int no_words(int no_bits) noexcept nogil:
+    return (no_bits + 63) >> 6
+
+
+cdef inline bool test_bit(const uint64_t *bits, int pos) noexcept nogil:
+    return (bits[pos >> 6] >> (pos & 63)) & 1
+
+
+cdef inline void set_bit(uint64_t *bits, int pos) noexcept nogil:
+    bits[pos >> 6] |= (<uint64_t>1) << (pos & 63)
+
+
+cdef inline void clear_bit(uint64_t *bits, int pos) noexcept nogil:
+    bits[pos >> 6] &= ~((<uint64_t>1) << (pos & 63))
+
+
+cdef long long luby(long long k) noexcept nogil:
+    # 1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8, ... for k = 0, 1, ...
+    cdef long long size = 1, seq = 0
+    while size < k + 1:
+        seq += 1
+        size = 2 * size + 1
+    while size - 1 != k:
+        size = (size - 1) >> 1
+        seq -= 1
+        k = k % size
+    return (<long long>1) << seq
+
+
+# nogoods are not recorded beyond this many literals in total, nor for the
+# levels below MAX_NOGOOD_LEVELS, whose long nogoods hardly ever complete
+cdef int MAX_NOGOOD_LITERALS = 1 << 22
+cdef int MAX_NOGOOD_LEVELS = 12
+
+
+cdef inline double get_time() noexcept nogil:
+    cdef timespec ts
+    clock_gettime(CLOCK_MONOTONIC, &ts)
+    return ts.tv_sec + 1e-9 * ts.tv_nsec
+
+
+cdef class CompiledGraph:
+    # adjacency of a graph on 0..n-1 in the form the solver uses; it is built
+    # once and shared by every solver it is given to, e.g. as the same H for
+    # many G's
+    cdef readonly int n
+    cdef int words
+    cdef vector[uint64_t] adjbits
+    cdef vector[bool] adjacency
+
+    def __init__(self, int n):
+        if n < 0:
+            raise ValueError('graph with %d vertices' % n)
+        self.n = n
+        self.words = no_words(n)
+        self.adjbits = vector[uint64_t](n * self.words, 0)
+
+    cdef void add_edge(self, int u, int v) noexcept nogil:
+        set_bit(self.adjbits.data() + u * self.words, v)
+        set_bit(self.adjbits.data() + v * self.words, u)
+
+    cdef void finish(self) noexcept nogil:
+        # the solver reads both forms, rows that are not symmetric are
+        # completed in both
+        cdef int u, v
+        self.adjacency = vector[bool](self.n * self.n, 0)
+        for u in range(self.n):
+            for v in range(self.n):
+                if test_bit(self.adjbits.data() + u * self.words, v):
+                    set_bit(self.adjbits.data() + v * self.words, u)
+                    self.adjacency[u * self.n + v] = 1
+                    self.adjacency[v * self.n + u] = 1
+
+    @staticmethod
+    def from_edges(int n, edges):
+        # any iterable of pairs, e.g. a numpy array of shape (m, 2)
+        cdef CompiledGraph c = CompiledGraph(n)
+        for u, v in edges:
+            # add_edge writes to the bits as they are
+            if not (0 <= u < n and 0 <= v < n):
+                raise ValueError('edge (%s, %s) of a graph on %d vertices' % (u, v, n))
+            c.add_edge(u, v)
+        c.finish()
+        return c
+
+    @staticmethod
+    def from_matrix(matrix):
+        cdef int u, v
+        cdef CompiledGraph c = CompiledGraph(len(matrix))
+        for u in range(c.n):
+            row = matrix[u]
+            for v in range(c.n):
+                if row[v]:
+                    c.add_edge(u, v)
+        c.finish()
+        return c
+
+    @staticmethod
+    def from_rows(rows):
+        # row u is a python integer with bit v set for every edge uv, bits
+        # beyond the last vertex are dropped
+        cdef int u, w
+        cdef CompiledGraph c = CompiledGraph(len(rows))
+        mask = (<object>1 << c.n) - 1
+        for u in range(c.n):
+            row = rows[u] & mask
+            for w in range(c.words):
+                c.adjbits[u * c.words + w] |= (row >> (w << 6)) & 0xffffffffffffffff
+        c.finish()
+        return c
+
+    @staticmethod
+    def from_graph6(data):
+        # graph_corpus decodes graph6 into bitset rows
+        return CompiledGraph.from_rows(decode_graph6(bytes(data)).rows)
+
+    @staticmethod
+    def from_networkx(g):
+        nodes = list(g.nodes())
+        if sorted(nodes) != list(range(len(nodes))):
+            # other labels stand for their positions in sorted order
+            index = {nd : i for i, nd in enumerate(sorted(nodes))}
+            return CompiledGraph.from_edges(len(nodes), [(index[u], index[v]) for (u, v) in g.edges()])
+        return CompiledGraph.from_edges(len(nodes), g.edges())
+
+    def __len__(self):
+        return self.n
+
+    def nodes(self):
+        return range(self.n)
+
+    def has_edge(self, int u, int v):
+        return self.adjacency[u * self.n + v]
+
+    def edges(self):
+        return [(u, v) for u in range(self.n) for v in range(u + 1, self.n) if self.adjacency[u * self.n + v]]
+
+    def neighbors(self, int u):
+        return [v for v in range(self.n) if self.adjacency[u * self.n + v]]
+
+    def components(self):
+        seen = [False] * self.n
+        components = []
+        for s in range(self.n):
+            if seen[s]:
+                continue
+            seen[s] = True
+            component, stack = [], [s]
+            while stack:
+                u = stack.pop()
+                component.append(u)
+                for v in self.neighbors(u):
+                    if not seen[v]:
+                        seen[v] = True
+                        stack.append(v)
+            components.append(sorted(component))
+        return components
+
+    def subgraph(self, nodes):
+        index = {nd : i for i, nd in enumerate(nodes)}
+        return CompiledGraph.from_edges(len(nodes), [(index[u], index[v]) for u in nodes for v in self.neighbors(u) if u < v and v in index])
+
+
+cdef class SearchLimits:
+    # budget of one call, shared by every solver it runs: a number of search
+    # nodes, a deadline on the monotonic clock, and a flag that another
+    # thread can set with cancel() while the search runs without the GIL
+    cdef public long long nodes_left
+    cdef public double deadline
+    cdef public bool cancelled
+    cdef int steps
+
+    def __init__(self, long long node_limit=0, double time_limit=0):
+        self.nodes_left = node_limit if node_limit > 0 else -1
+        self.deadline = get_time() + time_limit if time_limit > 0 else 0
+        self.cancelled = False
+        self.steps = 0
+
+    def cancel(self):
+        self.cancelled = True
+
+    cdef bool exhausted(self) noexcept nogil:
+        if self.cancelled or self.nodes_left == 0:
+            return True
+        self.steps += 1
+        if self.deadline > 0 and (self.steps & 1023) == 0 and get_time() > self.deadline:
+            self.cancelled = True
+        return self.cancelled
+
+
+class SearchInterrupted(Exception):
+    pass
+
+
+# the answer of a search that ran out of its limits
+UNKNOWN = 'UNKNOWN'
+
+
+def compile_graph(graph):
+    # networkx graphs, graph_corpus.BitGraph, graph6 bytes or compiled graphs
+    if isinstance(graph, CompiledGraph):
+        return graph
+    if isinstance(graph, (bytes, bytearray)):
+        return CompiledGraph.from_graph6(graph)
+    if hasattr(graph, 'rows'):
+        return CompiledGraph.from_rows(graph.rows)
+    if hasattr(graph, 'edges') and hasattr(graph, 'nodes'):
+        return CompiledGraph.from_networkx(graph)
+    # edge arrays and matrices look alike, they go through from_edges or from_matrix
+    raise TypeError('cannot compile a graph from %s, see CompiledGraph.from_edges and from_matrix' % type(graph).__name__)
 
 
 cdef class Solver:
@@ -20,13 +243,24 @@ cdef class Solver:
     cdef readonly int FORWARD
     cdef readonly int BACKTRACK
 
-    cdef object g
-    cdef object h
     cdef int no_gnodes
     cdef int no_hnodes
     cdef vector[bool] adjacency_g
     cdef vector[bool] adjacency_h
 
+    # bitset mode: domains and candidates as 64-bit words
+    cdef readonly bool bitset
+    # forward checking: domains are kept per depth, level i + 1 is level i
+    # after the assignment at depth i has been propagated to its neighbours
+    cdef readonly bool propagate
+    cdef int gwords
+    cdef int hwords
+    cdef vector[uint64_t] adjbits_g
+    cdef vector[uint64_t] adjbits_h
+    cdef vector[uint64_t] domains
+    cdef vector[uint64_t] candidates
+    cdef vector[uint64_t] assigned
+
     cdef int i
     cdef int action
     cdef vector[vector[int]] possibles
@@ -34,31 +268,85 @@ cdef class Solver:
     cdef vector[int] hcolor_inds
     cdef vector[int] soln
 
-    # heuristics
+    # heuristics, rank_g breaks the remaining ties between g-nodes
     cdef vector[int] error_g
     cdef vector[int] pruned_h
+    cdef vector[int] rank_g
+    cdef uint64_t rng
+
+    # restarts: the search starts over after restart_base * luby(k) backtracks
+    # in its k-th run, keeping error_g and pruned_h. the values refuted on the
+    # way are kept as nogoods, sets of literals g * no_hnodes + h that cannot
+    # all hold. each nogood watches two of its literals, and is only looked
+    # at when one of them holds; banned holds nogoods of a single literal
+    cdef long long restart_base
+    cdef long long run_backtracks
+    cdef public long long no_restarts
+    cdef vector[int] nogood_literals
+    cdef vector[int] nogood_start
+    cdef vector[int] nogood_watched
+    cdef vector[vector[int]] watches
+    cdef vector[bool] banned
+
+    # variable ordering: unassigned g-nodes bucketed by the number of their
+    # assigned neighbors, the counts are updated on every (un)assignment
+    cdef vector[int] assigned_nbs
+    cdef vector[uint64_t] buckets
+    cdef int top_bucket
+
+    # value ordering: number of assigned g-nodes whose image is adjacent to
+    # each h-node, and scratch space for sorting the possible images
+    cdef vector[int] image_nbs
+    cdef vector[pair[long long, int]] order_keys
+    cdef vector[int] order_tmp
 
     cdef public int no_solns
     cdef public object solution
 
-    def __init__(self, object g, object h):
+    # search effort: assignments made and assignments undone
+    cdef public long long no_nodes
+    cdef public long long no_backtracks
+
+    # collected with stats=True only, they cost two clock reads per step
+    cdef bool stats
+    cdef SearchLimits limits
+    cdef public bool interrupted
+    cdef public int max_depth
+    cdef public double ordering_time
+    cdef public double checking_time
+
+    def __init__(self, object g, object h, bool bitset=True, bool propagate=False, bool stats=False, SearchLimits limits=None,
+                 int seed=0, weights=None, long long restarts=0):
+        # seed: shuffles the ties of variable and value ordering, 0 for none,
+        # weights: initial failure counts of the g-nodes, e.g. the get_weights
+        # of an earlier search, restarts: backtracks of the first run before
+        # a restart, 0 for none
+        cdef int i, j, no_levels
+        cdef CompiledGraph cg = compile_graph(g)
+        cdef CompiledGraph ch = compile_graph(h)
         self.UNDEFINED = -1
         self.FORWARD = 0
         self.BACKTRACK = 1
 
-        self.g = g
-        self.no_gnodes = len(g.nodes())
-        self.adjacency_g = vector[bool](self.no_gnodes ** 2, 0)
-        for e in g.edges():
-            self.adjacency_g[e[0] * self.no_gnodes + e[1]] = 1
-            self.adjacency_g[e[1] * self.no_gnodes + e[0]] = 1
+        self.no_gnodes = cg.n
+        self.adjacency_g = cg.adjacency
+        self.no_hnodes = ch.n
+        self.adjacency_h = ch.adjacency
 
-        self.h = h
-        self.no_hnodes = len(h.nodes())
-        self.adjacency_h = vector[bool](self.no_hnodes ** 2, 0)
-        for e in h.edges():
-            self.adjacency_h[e[0] * self.no_hnodes + e[1]] = 1
-            self.adjacency_h[e[1] * self.no_hnodes + e[0]] = 1
+        self.propagate = propagate
+        self.bitset = bitset or propagate
+        self.gwords = cg.words
+        self.hwords = ch.words
+        self.adjbits_g = cg.adjbits
+        self.assigned = vector[uint64_t](self.gwords, 0)
+        self.adjbits_h = ch.adjbits
+        if self.bitset:
+            no_levels = self.no_gnodes + 1 if self.propagate else 1
+            self.domains = vector[uint64_t](no_levels * self.no_gnodes * self.hwords, 0)
+            for i in range(self.no_gnodes):
+                for j in range(self.no_hnodes):
+                    set_bit(self.domains.data() + i * self.hwords, j)
+            self.candidates = vector[uint64_t](self.no_gnodes * self.hwords, 0)
 
         self.i = 0
         self.possibles = vector[vector[int]](self.no_gnodes, vector[int](self.no_hnodes, 0))
@@ -73,19 +361,62 @@ cdef class Solver:
         self.action = self.FORWARD
 
         self.error_g = vector[int](self.no_gnodes, 0)
+        if weights is not None:
+            for i in range(self.no_gnodes):
+                self.error_g[i] = weights[i]
         self.pruned_h = vector[int](self.no_hnodes, 0)
+        self.rank_g = vector[int](self.no_gnodes, 0)
+        self.rng = 0x9e3779b97f4a7c15 ^ <uint64_t>seed
+        if seed != 0:
+            rnd = Random(seed)
+            for i, j in enumerate(rnd.sample(range(self.no_gnodes), self.no_gnodes)):
+                self.rank_g[i] = j
+            for i in range(self.no_gnodes):
+                order = rnd.sample(range(self.no_hnodes), self.no_hnodes)
+                for j in range(self.no_hnodes):
+                    self.possibles[i][j] = order[j]
+
+        self.restart_base = restarts
+        self.run_backtracks = 0
+        self.no_restarts = 0
+        self.nogood_start = vector[int](1, 0)
+        if restarts > 0:
+            self.watches = vector[vector[int]](self.no_gnodes * self.no_hnodes)
+            self.banned = vector[bool](self.no_gnodes * self.no_hnodes, 0)
+
+        self.assigned_nbs = vector[int](self.no_gnodes, 0)
+        self.buckets = vector[uint64_t](self.no_gnodes * self.gwords, 0)
+        for i in range(self.no_gnodes):
+            set_bit(self.buckets.data(), i)
+        self.top_bucket = 0
+
+        self.image_nbs = vector[int](self.no_hnodes, 0)
+        self.order_keys.resize(self.no_hnodes)
+        self.order_tmp = vector[int](self.no_hnodes, 0)
+
+        if self.propagate and not self.make_arc_consistent():
+            # some G-vertex has no possible image, there is nothing to search
+            self.i = -1
 
         self.no_solns = 0
         self.solution = None
+        self.no_nodes = 0
+        self.no_backtracks = 0
+        self.stats = stats
+        self.limits = limits
+        self.interrupted = False
+        self.max_depth = 0
+        self.ordering_time = 0
+        self.checking_time = 0
 
-    cdef bool is_last_option(self) nogil:
+    cdef bool is_last_option(self) noexcept nogil:
         cdef int i
         cdef unsigned hcolor
         i = 0 if self.i < 0 else self.i
         hcolor = self.g_nodes[i]
         return self.hcolor_ind() == self.possibles[hcolor].size() - 1
 
-    cdef bool is_valid_option(self, int val=-1) nogil:
+    cdef bool is_valid_option(self, int val=-1) noexcept nogil:
         cdef int i
         cdef unsigned hcolor
         i = 0 if self.i < 0 else self.i
@@ -94,7 +425,7 @@ cdef class Solver:
             val = self.hcolor_ind()
         return val >= 0 and val < self.possibles[hcolor].size()
 
-    cdef void forward_node(self, int mapto) nogil:
+    cdef void forward_node(self, int mapto) noexcept nogil:
         cdef int i
         cdef unsigned ind
         cdef unsigned hcolor
@@ -103,10 +434,123 @@ cdef class Solver:
         self.action = self.FORWARD
         self.hcolor_inds[ind] = mapto
         hcolor = self.hcolor_inds[ind]
+        if self.soln[ind] == self.UNDEFINED:
+            self.assign_node(ind)
+        else:
+            self.update_image_nbs(self.soln[ind], -1)
         self.soln[ind] = self.possibles[ind][hcolor]
+        self.update_image_nbs(self.soln[ind], 1)
+        if self.watches.size() > 0:
+            self.update_watches(ind * self.no_hnodes + self.soln[ind])
         self.i += 1
 
-    cdef void set_rollback(self) nogil:
+    cdef inline bool literal_holds(self, int literal) noexcept nogil:
+        return self.soln[literal // self.no_hnodes] == literal % self.no_hnodes
+
+    cdef void update_watches(self, int literal) noexcept nogil:
+        # literal holds now, the nogoods watching it move to a literal that
+        # does not hold, if they have one
+        cdef int k, c, pos, other, j
+        cdef vector[int] *watching = &self.watches[literal]
+        k = 0
+        while k < watching.size():
+            c = watching[0][k]
+            pos = 2 * c if self.nogood_literals[self.nogood_watched[2 * c]] == literal else 2 * c + 1
+            other = self.nogood_literals[self.nogood_watched[4 * c + 1 - pos]]
+            for j in range(self.nogood_start[c], self.nogood_start[c + 1]):
+                if self.nogood_literals[j] != other and self.nogood_literals[j] != literal \
+                        and not self.literal_holds(self.nogood_literals[j]):
+                    self.nogood_watched[pos] = j
+                    self.watches[self.nogood_literals[j]].push_back(c)
+                    watching[0][k] = watching[0][watching.size() - 1]
+                    watching.pop_back()
+                    break
+            else:
+                k += 1
+
+    cdef bool is_nogood(self, int ind, int hu) noexcept nogil:
+        # whether ind -> hu completes a nogood
+        cdef int literal, other, c, k, j
+        cdef bool complete
+        if self.watches.size() == 0:
+            return False
+        literal = ind * self.no_hnodes + hu
+        if self.banned[literal]:
+            return True
+        for k in range(self.watches[literal].size()):
+            c = self.watches[literal][k]
+            # the other watched literal only holds if no free literal is left
+            other = self.nogood_literals[self.nogood_watched[2 * c]]
+            if other == literal:
+                other = self.nogood_literals[self.nogood_watched[2 * c + 1]]
+            if not self.literal_holds(other):
+                continue
+            complete = True
+            for j in range(self.nogood_start[c], self.nogood_start[c + 1]):
+                if self.nogood_literals[j] != literal and not self.literal_holds(self.nogood_literals[j]):
+                    complete = False
+                    break
+            if complete:
+                return True
+        return False
+
+    cdef void add_nogood(self, int depth, int literal) noexcept nogil:
+        # the assignments of the first depth levels together with literal
+        cdef int d, c
+        if depth == 0:
+            self.banned[literal] = True
+            return
+        c = self.nogood_start.size() - 1
+        for d in range(depth):
+            self.nogood_literals.push_back(self.g_nodes[d] * self.no_hnodes + self.soln[self.g_nodes[d]])
+        self.nogood_literals.push_back(literal)
+        self.nogood_start.push_back(self.nogood_literals.size())
+        # nothing holds after the restart, any two literals can be watched
+        self.nogood_watched.push_back(self.nogood_start[c])
+        self.nogood_watched.push_back(self.nogood_start[c + 1] - 1)
+        self.watches[self.nogood_literals[self.nogood_start[c]]].push_back(c)
+        self.watches[literal].push_back(c)
+
+    cdef void restart(self) noexcept nogil:
+        # every value before the current one of a level was refuted under the
+        # assignments of the levels above it; those that are compatible with
+        # them become nogoods. the current value of the top level is refuted
+        # as well when the search is backing up
+        cdef int no_levels, d, j, k, ind, hu, last
+        cdef bool compatible
+        no_levels = self.i if self.action == self.FORWARD else self.i + 1
+        for d in range(min(no_levels, MAX_NOGOOD_LEVELS)):
+            ind = self.g_nodes[d]
+            last = self.hcolor_inds[ind] + (1 if d == self.i else 0)
+            for k in range(last):
+                if self.nogood_literals.size() > MAX_NOGOOD_LITERALS:
+                    break
+                hu = self.possibles[ind][k]
+                compatible = True
+                for j in range(d):
+                    if self.g_has_edge(ind, self.g_nodes[j]) and not self.h_has_edge(hu, self.soln[self.g_nodes[j]]):
+                        compatible = False
+                        break
+                if compatible:
+                    self.add_nogood(d, ind * self.no_hnodes + hu)
+        for d in range(no_levels):
+            ind = self.g_nodes[d]
+            self.unassign_node(ind)
+            self.update_image_nbs(self.soln[ind], -1)
+            self.soln[ind] = self.UNDEFINED
+            self.hcolor_inds[ind] = self.UNDEFINED
+        # new ties between g-nodes
+        for d in range(self.no_gnodes):
+            self.rng ^= self.rng << 13
+            self.rng ^= self.rng >> 7
+            self.rng ^= self.rng << 17
+            self.rank_g[d] = self.rng >> 33
+        self.i = 0
+        self.action = self.FORWARD
+        self.run_backtracks = 0
+        self.no_restarts += 1
+
+    cdef void set_rollback(self) noexcept nogil:
         cdef int i
         cdef unsigned ind
         i = max(0, self.i)
@@ -115,146 +559,410 @@ cdef class Solver:
         self.action = self.BACKTRACK
         # self.g_nodes[i] = Solver.UNDEFINED
         self.hcolor_inds[ind] = self.UNDEFINED
+        if self.soln[ind] != self.UNDEFINED:
+            self.unassign_node(ind)
+            self.update_image_nbs(self.soln[ind], -1)
         self.soln[ind] = self.UNDEFINED
         self.i -= 1
 
-    cdef int hcolor_ind(self) nogil:
+    cdef int hcolor_ind(self) noexcept nogil:
         cdef int i
         i = max(0, self.i)
         return self.hcolor_inds[self.g_nodes[i]]
 
-    cdef inline bool g_has_edge(self, int u, int v) nogil:
+    cdef inline bool g_has_edge(self, int u, int v) noexcept nogil:
         return self.adjacency_g[u * self.no_gnodes + v]
 
-    cdef inline bool h_has_edge(self, int u, int v) nogil:
+    cdef inline bool h_has_edge(self, int u, int v) noexcept nogil:
         return self.adjacency_h[u * self.no_hnodes + v]
 
-    cdef inline int find_possible_map(self) nogil:
+    cdef inline uint64_t *domain(self, int level, int ind) noexcept nogil:
+        if not self.propagate:
+            level = 0
+        return self.domains.data() + (level * self.no_gnodes + ind) * self.hwords
+
+    cdef bool is_empty(self, const uint64_t *bits, int nwords) noexcept nogil:
+        cdef int k
+        for k in range(nwords):
+            if bits[k]:
+                return False
+        return True
+
+    cdef bool make_arc_consistent(self) noexcept nogil:
+        # remove h-colors from the initial domains until for every edge (u, v)
+        # of G each color of u has a neighbor in the domain of v
+        cdef int u, v, a, w, k
+        cdef uint64_t word
+        cdef bool changed, supported
+        cdef uint64_t *dom_u
+        cdef const uint64_t *dom_v
+        cdef const uint64_t *row
+        changed = True
+        while changed:
+            changed = False
+            for u in range(self.no_gnodes):
+                dom_u = self.domain(0, u)
+                for w in range(self.gwords):
+                    word = self.adjbits_g[u * self.gwords + w]
+                    while word:
+                        v = (w << 6) + __builtin_ctzll(word)
+                        word &= word - 1
+                        dom_v = self.domain(0, v)
+                        for a in range(self.no_hnodes):
+                            if not test_bit(dom_u, a):
+                                continue
+                            row = self.adjbits_h.data() + a * self.hwords
+                            supported = False
+                            for k in range(self.hwords):
+                                if row[k] & dom_v[k]:
+                                    supported = True
+                                    break
+                            if not supported:
+                                clear_bit(dom_u, a)
+                                changed = True
+                if self.is_empty(dom_u, self.hwords):
+                    return False
+        return True
+
+    cdef bool forward_check(self, int i, int ind, int hu) noexcept nogil:
+        # propagate ind -> hu into level i + 1, false if some domain is wiped out
+        cdef int w, k, gw
+        cdef uint64_t word, nonempty
+        cdef uint64_t *dom
+        cdef const uint64_t *row
+        cdef uint64_t *src = self.domain(i, 0)
+        cdef uint64_t *dst = self.domain(i + 1, 0)
+        for k in range(self.no_gnodes * self.hwords):
+            dst[k] = src[k]
+        row = self.adjbits_h.data() + hu * self.hwords
+        for w in range(self.gwords):
+            word = self.adjbits_g[ind * self.gwords + w] & ~self.assigned[w]
+            while word:
+                gw = (w << 6) + __builtin_ctzll(word)
+                word &= word - 1
+                if gw == ind:
+                    continue
+                dom = self.domain(i + 1, gw)
+                nonempty = 0
+                for k in range(self.hwords):
+                    dom[k] &= row[k]
+                    nonempty |= dom[k]
+                if not nonempty:
+                    self.error_g[gw] += 1
+                    return False
+        return True
+
+    cdef void compute_candidates(self, int i, int ind) noexcept nogil:
+        # candidates = domain of ind AND rows of the images of its assigned neighbours
+        cdef int w, k, gv
+        cdef uint64_t word
+        cdef uint64_t *cand = self.candidates.data() + i * self.hwords
+        cdef const uint64_t *row
+        cdef const uint64_t *dom = self.domain(i, ind)
+        for k in range(self.hwords):
+            cand[k] = dom[k]
+        if self.propagate:
+            # forward checking has already filtered the domain
+            return
+        for w in range(self.gwords):
+            word = self.adjbits_g[ind * self.gwords + w] & self.assigned[w]
+            while word:
+                gv = (w << 6) + __builtin_ctzll(word)
+                word &= word - 1
+                row = self.adjbits_h.data() + self.soln[gv] * self.hwords
+                for k in range(self.hwords):
+                    cand[k] &= row[k]
+
+    cdef inline int find_possible_map_bitset(self) noexcept nogil:
+        cdef int i, ind, mapto, hu
+        cdef const uint64_t *cand
+        i = 0 if self.i < 0 else self.i
+        ind = self.g_nodes[i]
+        mapto = self.hcolor_ind() + 1
+        if mapto == 0:
+            self.compute_candidates(i, ind)
+        cand = self.candidates.data() + i * self.hwords
+        while self.is_valid_option(mapto):
+            hu = self.possibles[ind][mapto]
+            if test_bit(cand, hu) and not self.is_nogood(ind, hu) and (not self.propagate or self.forward_check(i, ind, hu)):
+                break
+            self.pruned_h[hu] += 1
+            mapto += 1
+        return mapto
+
+    cdef inline int find_possible_map(self) noexcept nogil:
         cdef int i, ind, mapto
+        if self.bitset:
+            return self.find_possible_map_bitset()
         i = 0 if self.i < 0 else self.i
         ind = self.g_nodes[i]
         mapto = self.hcolor_ind() + 1
         # print(self.soln)
         while self.is_valid_option(mapto):
             approved = True
+            hu = self.possibles[ind][mapto]
             if i > 0:
                 gu = ind
-                hu = self.possibles[gu][mapto]
                 for j in range(i):
                     gv = self.g_nodes[j]
                     hv = self.soln[gv]
                     if self.g_has_edge(gu, gv) and not self.h_has_edge(hu, hv):
                         approved = False
-                        self.pruned_h[mapto] += 1
+                        self.pruned_h[hu] += 1
                         break
+            if approved and self.is_nogood(ind, hu):
+                approved = False
+                self.pruned_h[hu] += 1
             if approved:
                 break
             mapto += 1
         return mapto
 
-    cdef is_valid_solution(self):
-        assert self.i == self.soln.size()
-        for e in list(self.g.edges()):
-            u, v = e
-            hu, hv = self.soln[u], self.soln[v]
-            if not self.h_has_edge(hu, hv):
-                return False
+    cdef bool is_valid_solution(self) noexcept nogil:
+        cdef int u, v, w
+        cdef uint64_t word
+        for u in range(self.no_gnodes):
+            for w in range(self.gwords):
+                word = self.adjbits_g[u * self.gwords + w]
+                while word:
+                    v = (w << 6) + __builtin_ctzll(word)
+                    word &= word - 1
+                    if not self.h_has_edge(self.soln[u], self.soln[v]):
+                        return False
         return True
 
-    cdef int count_g_neighbors_in_set(self, int node, vector[int] nodes) nogil:
-        cdef int ret
-        ret = 0
-        for out in nodes:
-            if self.g_has_edge(node, out):
-                ret += 1
-        return ret
-
-    cdef int count_h_neighbors_in_set(self, int node, vector[int] nodes) nogil:
-        cdef int ret
-        ret = 0
-        for out in nodes:
-            if self.h_has_edge(node, out):
-                ret += 1
-        return ret
+    cdef inline void move_to_bucket(self, int node, int src, int dst) noexcept nogil:
+        clear_bit(self.buckets.data() + src * self.gwords, node)
+        set_bit(self.buckets.data() + dst * self.gwords, node)
+        if dst > self.top_bucket:
+            self.top_bucket = dst
+
+    cdef void assign_node(self, int ind) noexcept nogil:
+        cdef int w, gw, count
+        cdef uint64_t word
+        set_bit(self.assigned.data(), ind)
+        clear_bit(self.buckets.data() + self.assigned_nbs[ind] * self.gwords, ind)
+        for w in range(self.gwords):
+            word = self.adjbits_g[ind * self.gwords + w]
+            while word:
+                gw = (w << 6) + __builtin_ctzll(word)
+                word &= word - 1
+                count = self.assigned_nbs[gw]
+                self.assigned_nbs[gw] = count + 1
+                if not test_bit(self.assigned.data(), gw):
+                    self.move_to_bucket(gw, count, count + 1)
+
+    cdef void unassign_node(self, int ind) noexcept nogil:
+        cdef int w, gw, count
+        cdef uint64_t word
+        clear_bit(self.assigned.data(), ind)
+        for w in range(self.gwords):
+            word = self.adjbits_g[ind * self.gwords + w]
+            while word:
+                gw = (w << 6) + __builtin_ctzll(word)
+                word &= word - 1
+                count = self.assigned_nbs[gw]
+                self.assigned_nbs[gw] = count - 1
+                if not test_bit(self.assigned.data(), gw):
+                    self.move_to_bucket(gw, count, count - 1)
+        count = self.assigned_nbs[ind]
+        set_bit(self.buckets.data() + count * self.gwords, ind)
+        if count > self.top_bucket:
+            self.top_bucket = count
+
+    cdef inline int domain_size(self, int ind) noexcept nogil:
+        cdef int k, size
+        cdef const uint64_t *dom = self.domain(self.i, ind)
+        size = 0
+        for k in range(self.hwords):
+            size += __builtin_popcountll(dom[k])
+        return size
 
     # heuristics
-    cdef choose_best_node(self):
-        cdef int option, rating, new_rating, ind
-        cdef vector[int] g_nodes_visited
-        cdef set[int] visited
-        option, rating = -1, -1
-        g_nodes_visited = self.g_nodes[:self.i]
-        visited = set[int](self.g_nodes[:self.i])
-        for ind in range(len(self)):
-            if visited.count(ind):
-                continue
-            new_rating = 0
-            no_nbs = self.count_g_neighbors_in_set(ind, g_nodes_visited)
-            new_rating += 100 * no_nbs
-            new_rating += 50 * (self.i - no_nbs)
-            if new_rating > rating:
-                option, rating = ind, new_rating
-            elif new_rating == rating and self.error_g[ind] > self.error_g[option]:
-                option, rating = ind, new_rating
+    cdef int choose_best_node(self) noexcept nogil:
+        # most assigned neighbors first, then smallest domain, then most
+        # failures, then highest rank
+        cdef int w, ind, option, size, best_size
+        cdef uint64_t word
+        cdef const uint64_t *bucket
+        while self.top_bucket > 0 and self.is_empty(self.buckets.data() + self.top_bucket * self.gwords, self.gwords):
+            self.top_bucket -= 1
+        bucket = self.buckets.data() + self.top_bucket * self.gwords
+        option, best_size = -1, -1
+        for w in range(self.gwords):
+            word = bucket[w]
+            while word:
+                ind = (w << 6) + __builtin_ctzll(word)
+                word &= word - 1
+                size = self.domain_size(ind) if self.propagate else 0
+                if option == -1 or size < best_size \
+                        or (size == best_size and self.error_g[ind] > self.error_g[option]) \
+                        or (size == best_size and self.error_g[ind] == self.error_g[option] and self.rank_g[ind] > self.rank_g[option]):
+                    option, best_size = ind, size
         if option != -1:
             return option
         return self.g_nodes[self.i]
 
-    cdef int choose_target_rating_func(self, int g_ind, int h_ind) nogil:
-        cdef int i, target, nb_count, rating
-        cdef vector[int] map_image
-        i = max(0, self.i)
-        target = self.possibles[g_ind][h_ind]
-        map_image = vector[int](i)
-        for idx in range(i):
-            map_image[idx] = self.soln[self.g_nodes[idx]]
-        # map_image = [self.soln[idx] for idx in self.g_nodes[:i]]
+    cdef void update_image_nbs(self, int hcolor, int delta) noexcept nogil:
+        cdef int w, hw
+        cdef uint64_t word
+        for w in range(self.hwords):
+            word = self.adjbits_h[hcolor * self.hwords + w]
+            while word:
+                hw = (w << 6) + __builtin_ctzll(word)
+                word &= word - 1
+                self.image_nbs[hw] += delta
+
+    cdef inline long long choose_target_rating_func(self, int target) noexcept nogil:
+        cdef int nb_count
+        cdef long long rating
+        nb_count = self.image_nbs[target]
         rating = 0
-        nb_count = self.count_h_neighbors_in_set(target, map_image)
         rating += 10000 * nb_count
-        rating += 1000 * (map_image.size() - nb_count)
-        rating += self.pruned_h[h_ind]
+        rating += 1000 * (self.i - nb_count)
+        rating += self.pruned_h[target]
         return rating
 
     # heuristics
-    cdef void choose_target_order(self):
-        cdef int i, g_ind
+    cdef void choose_target_order(self) noexcept nogil:
+        # stable sort of the possible images by decreasing rating
+        cdef int i, g_ind, k, size
         i = max(0, self.i)
         g_ind = self.g_nodes[i]
-        hcolors = [x for x in self.possibles[g_ind]]
-        hcolors.sort(key=lambda h_ind: self.choose_target_rating_func(g_ind, h_ind), reverse=True)
-        self.possibles[g_ind] = hcolors
-        # print(self.i, [x for x in self.possibles[g_ind]])
+        size = self.possibles[g_ind].size()
+        for k in range(size):
+            self.order_tmp[k] = self.possibles[g_ind][k]
+            self.order_keys[k].first = -self.choose_target_rating_func(self.order_tmp[k])
+            self.order_keys[k].second = k
+        sort(self.order_keys.begin(), self.order_keys.begin() + size)
+        for k in range(size):
+            self.possibles[g_ind][k] = self.order_tmp[self.order_keys[k].second]
+
+    cdef bool search(self) noexcept nogil:
+        # advance to the next solution, false once the search space is
+        # exhausted or the limits are
+        cdef int mapto
+        cdef double start = 0
+        while self.i >= 0 and self.i < self.no_gnodes:
+            if self.limits is not None and self.limits.exhausted():
+                # the search stops where it is and can be continued later
+                self.interrupted = True
+                return False
+            if self.stats:
+                start = get_time()
+                self.max_depth = max(self.max_depth, self.i + 1)
+            if self.action == self.FORWARD:
+                # choose g-node
+                self.g_nodes[self.i] = self.choose_best_node()
+                # select order in which h-colors will be tested
+                if self.i + 5 < self.no_gnodes:
+                    self.choose_target_order()
+                if self.stats:
+                    self.ordering_time += get_time() - start
+                    start = get_time()
+            mapto = self.find_possible_map()
+            if self.stats:
+                self.checking_time += get_time() - start
+            if self.is_valid_option(mapto):
+                self.forward_node(mapto)
+                self.no_nodes += 1
+                if self.limits is not None and self.limits.nodes_left > 0:
+                    self.limits.nodes_left -= 1
+            else:
+                self.set_rollback()
+                self.no_backtracks += 1
+                self.run_backtracks += 1
+                if self.restart_base > 0 and self.i >= 0 and self.run_backtracks >= self.restart_base * luby(self.no_restarts):
+                    self.restart()
+        if self.i >= 0:
+            # refuted values are nogoods only as long as no solution was
+            # found below them, the rest of the search goes without restarts
+            self.restart_base = 0
+        return self.i >= 0
+
+    cdef long long count_solutions_nogil(self) noexcept nogil:
+        cdef long long count = 0
+        while self.search():
+            count += 1
+            self.i -= 1
+            self.action = self.BACKTRACK
+        return count
+
+    def count_solutions(self):
+        # runs the whole enumeration in C, without a call per solution
+        cdef long long count
+        with nogil:
+            count = self.count_solutions_nogil()
+        self.no_solns += count
+        self.check_interrupted()
+        return count
+
+    cdef int fill_batch(self, int[::1] out, int batch_size) noexcept nogil:
+        cdef int k = 0, j
+        while k < batch_size and self.search():
+            for j in range(self.no_gnodes):
+                out[k * self.no_gnodes + j] = self.soln[j]
+            k += 1
+            self.i -= 1
+            self.action = self.BACKTRACK
+        return k
+
+    def iterate_solutions(self, int batch_size=1024):
+        # blocks of up to batch_size solutions, one per row: numpy arrays
+        # when numpy is installed, lists of lists otherwise
+        cdef int k
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+        buf = array.array('i', [0]) * (batch_size * max(1, self.no_gnodes))
+        while True:
+            k = self.fill_batch(buf, batch_size)
+            if k == 0:
+                self.check_interrupted()
+                return
+            self.no_solns += k
+            if np is not None:
+                yield np.frombuffer(buf, dtype=np.intc, count=k * self.no_gnodes).reshape(k, self.no_gnodes).copy()
+            else:
+                yield [buf[r * self.no_gnodes:(r + 1) * self.no_gnodes].tolist() for r in range(k)]
+            if k < batch_size:
+                return
 
     cpdef find_solutions(self, stopfunc):
+        cdef bool found
         while True:
-            while self.i in range(len(self)):
-                # print(self)
-                if self.action == self.FORWARD:
-                    # choose g-node
-                    self.g_nodes[self.i] = self.choose_best_node()
-                    # select order in which h-colors will be tested
-                    if self.i + 5 < self.soln.size():
-                        self.choose_target_order()
-                assert self.i >= -1
-                if self.action == self.BACKTRACK and self.hcolor_ind() != self.UNDEFINED:
-                    pass
-                mapto = self.find_possible_map()
-                if self.is_valid_option(mapto):
-                    self.forward_node(mapto)
-                else:
-                    self.set_rollback()
-            if self.i < 0:
+            with nogil:
+                found = self.search()
+            if not found:
+                self.check_interrupted()
                 break
-            # print(self)
             assert self.is_valid_solution()
             if not stopfunc([self.soln[i] for i in range(len(self.soln))]):
                 return
             self.i -= 1
             self.action = self.BACKTRACK
-        if self.i != -1 and not stopfunc([self.soln[i] for i in range(len(self.soln))]):
-            return
 
+    def get_weights(self):
+        return [self.error_g[u] for u in range(self.no_gnodes)]
+
+    def check_interrupted(self):
+        if self.interrupted:
+            self.interrupted = False
+            raise SearchInterrupted()
+
+    def get_stats(self):
+        # failures: how often the search backed up over each g-node
+        return {
+            'nodes' : self.no_nodes,
+            'backtracks' : self.no_backtracks,
+            'max_depth' : self.max_depth,
+            'ordering_time' : self.ordering_time,
+            'checking_time' : self.checking_time,
+            'failures' : {u : self.error_g[u] for u in range(self.no_gnodes) if self.error_g[u] > 0},
+            'restarts' : self.no_restarts,
+            'nogoods' : self.nogood_start.size() - 1,
+        }
 
     def __str__(self):
         s = 'backtrack' if self.action else 'forward'
@@ -271,22 +979,335 @@ def compose_solutions(psi, phi):
     return [phi[x] for x in psi]
 
 
-def find_homomorphisms(g, h):
-    s = Solver(g, h)
-    def stopfunc(soln):
-        s.no_solns += 1
-        return True
-    s.find_solutions(stopfunc)
-    return s.no_solns
+def count_homomorphisms(g, h, stats=None, **kwargs):
+    # the number of homomorphisms is the product over the components of G
+    g, h = compile_graph(g), compile_graph(h)
+    count = 1
+    for component in g.components():
+        if count == 0:
+            break
+        if len(component) == 1:
+            count *= len(h)
+            continue
+        s = Solver(g.subgraph(component), h, stats=stats is not None, **kwargs)
+        count *= s.count_solutions()
+        if stats is not None:
+            stats.append(s.get_stats())
+            stats[-1]['failures'] = {component[u] : k for u, k in stats[-1]['failures'].items()}
+    return count
+
 
+def find_homomorphisms(g, h, **kwargs):
+    return count_homomorphisms(g, h, **kwargs)
 
-def is_homomorphic(g, h):
-    s = Solver(g, h)
+
+def iterate_homomorphisms(g, h, batch_size=1024, **kwargs):
+    return Solver(g, h, **kwargs).iterate_solutions(batch_size)
+
+
+def find_first_solution(s):
     def func(soln):
         s.no_solns = 1
-        s.solution = [s.soln[i] for i in range(len(s.soln))]
+        s.solution = soln
         return False
     s.find_solutions(stopfunc=func)
     if s.no_solns == 1:
         return s.solution
     return None
+
+
+def search_homomorphism(g, h, stats=None, **kwargs):
+    # stats: a list that gets the get_stats of the search appended
+    s = Solver(g, h, stats=stats is not None, **kwargs)
+    phi = find_first_solution(s)
+    if stats is not None:
+        stats.append(s.get_stats())
+    return phi
+
+
+def strip_pendant_trees(g):
+    # repeatedly remove vertices of degree 1; returns the remaining vertices
+    # and the removed (vertex, neighbour) pairs in the order of removal
+    degree = [len(g.neighbors(u)) for u in range(g.n)]
+    removed = [False] * g.n
+    pendants = []
+    leaves = [u for u in range(g.n) if degree[u] == 1]
+    while leaves:
+        u = leaves.pop()
+        if removed[u] or degree[u] != 1:
+            continue
+        removed[u] = True
+        w = [v for v in g.neighbors(u) if not removed[v]][0]
+        pendants.append((u, w))
+        degree[w] -= 1
+        if degree[w] == 1:
+            leaves.append(w)
+    return [u for u in range(g.n) if not removed[u]], pendants
+
+
+def find_tree_decomposition(g, max_width):
+    # (width, tree of bags) from the min-fill-in heuristic, None if too wide
+    from networkx.algorithms.approximation import treewidth_min_fill_in
+    width, tree = treewidth_min_fill_in(nx.Graph(g.edges()))
+    if width > max_width:
+        return None
+    return width, tree
+
+
+def solve_tree_decomposition(g, h, tree):
+    # dynamic programming over the bags: the valid maps of every bag that
+    # extend to the subtree below it, with a compatible map of each child
+    bags = list(tree.nodes())
+    root = bags[0]
+    order = list(nx.dfs_preorder_nodes(tree, root))
+    parent = {root : None}
+    for (a, b) in nx.dfs_edges(tree, root):
+        parent[b] = a
+    children = {bag : [] for bag in bags}
+    for bag in order[1:]:
+        children[parent[bag]].append(bag)
+    nodes = {bag : sorted(bag) for bag in bags}
+    tables = {}
+
+    def bag_maps(bag):
+        vs = nodes[bag]
+        current = [None] * len(vs)
+
+        def extend(k):
+            if k == len(vs):
+                yield tuple(current)
+                return
+            for x in range(h.n):
+                if all(not g.has_edge(vs[k], vs[j]) or h.has_edge(x, current[j]) for j in range(k)):
+                    current[k] = x
+                    yield from extend(k + 1)
+        return extend(0)
+
+    def shared_key(bag, child, phi):
+        return tuple(phi[nodes[bag].index(v)] for v in nodes[child] if v in bag)
+
+    for bag in reversed(order):
+        child_keys = []
+        for child in children[bag]:
+            keys = {}
+            for phi in tables[child]:
+                keys.setdefault(tuple(phi[nodes[child].index(v)] for v in nodes[child] if v in bag), phi)
+            child_keys.append(keys)
+        table = {}
+        for phi in bag_maps(bag):
+            chosen = []
+            for child, keys in zip(children[bag], child_keys):
+                key = shared_key(bag, child, phi)
+                if key not in keys:
+                    break
+                chosen.append(keys[key])
+            else:
+                table[phi] = chosen
+        if len(table) == 0:
+            return None
+        tables[bag] = table
+    soln = [None] * g.n
+    stack = [(root, next(iter(tables[root])))]
+    while stack:
+        bag, phi = stack.pop()
+        for v, x in zip(nodes[bag], phi):
+            soln[v] = x
+        stack += zip(children[bag], tables[bag][phi])
+    return soln
+
+
+class DecomposedGraph:
+    # pendant trees are stripped, the components of what is left are solved
+    # on their own, and the trees put back: a leaf goes to any neighbour of
+    # the image of its neighbour. none of this depends on H, so it is done
+    # once for searches of G against many targets
+    def __init__(self, g, treewidth=0):
+        self.g = compile_graph(g)
+        rest, self.pendants = strip_pendant_trees(self.g)
+        rest_graph = self.g.subgraph(rest)
+        self.isolated = []
+        self.components = []
+        for component in rest_graph.components():
+            nodes = [rest[u] for u in component]
+            if len(nodes) == 1:
+                # an isolated vertex, or what is left of a tree
+                self.isolated.append(nodes[0])
+                continue
+            sub = rest_graph.subgraph(component)
+            decomposition = find_tree_decomposition(sub, treewidth) if treewidth > 0 else None
+            self.components.append((nodes, sub, decomposition))
+
+    def solve(self, h, **kwargs):
+        h = compile_graph(h)
+        soln = [None] * self.g.n
+        for u in self.isolated:
+            images = [x for x in range(h.n) if len(self.g.neighbors(u)) == 0 or len(h.neighbors(x)) > 0]
+            if len(images) == 0:
+                return None
+            soln[u] = images[0]
+        for nodes, sub, decomposition in self.components:
+            if decomposition is not None and h.n ** (decomposition[0] + 1) <= 1000000:
+                psi = solve_tree_decomposition(sub, h, decomposition[1])
+            else:
+                psi = search_homomorphism(sub, h, **kwargs)
+                if kwargs.get('stats') is not None:
+                    # failures of the component's vertices are reported for the vertices of G
+                    failures = kwargs['stats'][-1]['failures']
+                    kwargs['stats'][-1]['failures'] = {nodes[u] : k for u, k in failures.items()}
+            if psi is None:
+                return None
+            for u, x in zip(nodes, psi):
+                soln[u] = x
+        for (u, w) in reversed(self.pendants):
+            soln[u] = h.neighbors(soln[w])[0]
+        return soln
+
+
+def solve_decomposed(g, h, treewidth=0, **kwargs):
+    return DecomposedGraph(g, treewidth).solve(h, **kwargs)
+
+
+def is_homomorphic(g, h, cores=False, decompose=True, treewidth=0, **kwargs):
+    # decompose: split G into components and strip its pendant trees first,
+    # treewidth: largest width of a tree decomposition solved by DP instead,
+    # stats: a list that gets the statistics of every search appended,
+    # limits: SearchLimits of the call, SearchInterrupted once they run out
+    if cores:
+        g_core = find_core(g, decompose=decompose, treewidth=treewidth, **kwargs)
+        h_core = find_core(h, decompose=decompose, treewidth=treewidth, **kwargs)
+        return is_homomorphic_cores(g_core, h_core, decompose=decompose, treewidth=treewidth, **kwargs)
+    if decompose:
+        return solve_decomposed(g, h, treewidth, **kwargs)
+    return search_homomorphism(g, h, **kwargs)
+
+
+def is_homomorphic_limited(g, h, node_limit=0, time_limit=0, limits=None, **kwargs):
+    # is_homomorphic within a number of search nodes and seconds, or within
+    # the given SearchLimits; UNKNOWN if they run out before an answer
+    if limits is None:
+        limits = SearchLimits(node_limit, time_limit)
+    try:
+        return is_homomorphic(g, h, limits=limits, **kwargs)
+    except SearchInterrupted:
+        return UNKNOWN
+
+
+# configurations raced by is_homomorphic_portfolio
+PORTFOLIO = [
+    {},
+    {'propagate' : True},
+    {'seed' : 1},
+    {'seed' : 2, 'propagate' : True},
+    {'restarts' : 100},
+]
+
+
+def is_homomorphic_portfolio(g, h, configs=PORTFOLIO, node_limit=0, time_limit=0):
+    # is_homomorphic with every configuration in its own thread, the solvers
+    # run without the GIL. the first answer cancels the other searches, and
+    # each one gets the node limit; UNKNOWN if all of them run out
+    g, h = compile_graph(g), compile_graph(h)
+    answers = []
+    lock = threading.Lock()
+    all_limits = [SearchLimits(node_limit, time_limit) for config in configs]
+
+    def run(config, limits):
+        try:
+            phi = is_homomorphic(g, h, limits=limits, **config)
+        except SearchInterrupted:
+            return
+        with lock:
+            answers.append(phi)
+            for other in all_limits:
+                other.cancel()
+
+    threads = [threading.Thread(target=run, args=(config, limits)) for config, limits in zip(configs, all_limits)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if len(answers) == 0:
+        return UNKNOWN
+    return answers[0]
+
+
+def is_homomorphic_targets(g, targets, implies=None, decompose=True, treewidth=0, node_limit=0, time_limit=0, portfolio=False, **kwargs):
+    # is_homomorphic of one G against many H. G is compiled and decomposed
+    # once, and the targets are searched from the smallest one. implies(i, j)
+    # tells whether targets[i] -> targets[j] is known; such relations decide
+    # targets without a search, G -> H_i -> H_j and G -/-> H_i <- H_j, and
+    # a target that is known to be an image this way gets True instead of a map.
+    # with a node or time limit, each target gets its own, and UNKNOWN if it
+    # runs out. portfolio: every target is raced by is_homomorphic_portfolio
+    g = compile_graph(g)
+    targets = [compile_graph(h) for h in targets]
+    parts = DecomposedGraph(g, treewidth) if decompose else None
+    order = sorted(range(len(targets)), key=lambda i: (targets[i].n, len(targets[i].edges())))
+    results = [None] * len(targets)
+    decided = [False] * len(targets)
+    for i in order:
+        if decided[i]:
+            continue
+        if node_limit > 0 or time_limit > 0:
+            kwargs['limits'] = SearchLimits(node_limit, time_limit)
+        try:
+            if portfolio:
+                results[i] = is_homomorphic_portfolio(g, targets[i], node_limit=node_limit, time_limit=time_limit)
+            elif parts is not None:
+                results[i] = parts.solve(targets[i], **kwargs)
+            else:
+                results[i] = search_homomorphism(g, targets[i], **kwargs)
+        except SearchInterrupted:
+            results[i] = UNKNOWN
+        decided[i] = True
+        if implies is None or results[i] == UNKNOWN:
+            continue
+        for j in order:
+            if decided[j]:
+                continue
+            if results[i] is not None and implies(i, j):
+                results[j], decided[j] = True, True
+            elif results[i] is None and implies(j, i):
+                decided[j] = True
+    return results
+
+
+def find_core(g, **kwargs):
+    # repeatedly map the graph into itself minus a vertex, and keep the image.
+    # the core is compiled, embedding gives the node of g for each of its
+    # vertices and retraction the core vertex of each node of g, both in the
+    # sorted order of the nodes of g
+    core = compile_graph(g)
+    embedding = sorted(g.nodes()) if isinstance(g, nx.Graph) else list(range(core.n))
+    retraction = list(range(core.n))
+    reduced = True
+    while reduced and core.n > 1:
+        reduced = False
+        for v in range(core.n):
+            labels = [x for x in range(core.n) if x != v]
+            phi = is_homomorphic(core, core.subgraph(labels), **kwargs)
+            if phi is None:
+                continue
+            image = sorted(set(labels[x] for x in phi))
+            index = {nd: i for i, nd in enumerate(image)}
+            retraction = [index[labels[phi[x]]] for x in retraction]
+            embedding = [embedding[nd] for nd in image]
+            core = core.subgraph(image)
+            reduced = True
+            break
+    return core, retraction, embedding
+
+
+def lift_core_solution(g_core, h_core, psi):
+    # a map between the cores of G and H as a map from G to H
+    gc, g_retraction, g_embedding = g_core
+    hc, h_retraction, h_embedding = h_core
+    return [h_embedding[x] for x in compose_solutions(g_retraction, psi)]
+
+
+def is_homomorphic_cores(g_core, h_core, **kwargs):
+    # g_core, h_core are (core, retraction, embedding) triples from find_core
+    psi = is_homomorphic(g_core[0], h_core[0], **kwargs)
+    if psi is None:
+        return None
+    return lift_core_solution(g_core, h_core, psi)
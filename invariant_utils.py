@@ -0,0 +1,85 @@
+import os
+import json
+
+from graph_utils import *
+from homomorphism_solver import *
+
+
+def odd_girth(g):
+    # length of the shortest odd cycle, None for bipartite graphs
+    best = None
+    for s in g.nodes():
+        dist = nx.single_source_shortest_path_length(g, s)
+        for (u, v) in g.edges():
+            if u in dist and v in dist and dist[u] == dist[v]:
+                length = 2 * dist[u] + 1
+                if best is None or length < best:
+                    best = length
+    return best
+
+
+def max_clique(g):
+    clique = []
+    for c in nx.find_cliques(g):
+        if len(c) > len(clique):
+            clique = c
+    return sorted(clique)
+
+
+def find_colouring(g, lower_bound=1):
+    # smallest k such that G -> K_k, together with the colouring
+    if len(g.nodes()) == 0:
+        return 0, []
+    k = max(1, lower_bound)
+    while True:
+        colouring = is_homomorphic(g, nx.complete_graph(k), propagate=True)
+        if colouring is not None:
+            return k, colouring
+        k += 1
+
+
+def compute_invariants(g):
+    g = as_networkx(g)
+    clique = max_clique(g)
+    chromatic_number, colouring = find_colouring(g, len(clique))
+    return {
+        'no_nodes': len(g.nodes()),
+        'has_edge': len(g.edges()) > 0,
+        'bipartite': chromatic_number <= 2,
+        'clique': clique,
+        'odd_girth': odd_girth(g),
+        'chromatic_number': chromatic_number,
+        'colouring': colouring,
+    }
+
+
+def load_invariants(gfile, g=None):
+    inv_file = gfile + '.inv'
+    if os.path.exists(inv_file):
+        with open(inv_file, 'r') as f:
+            return json.load(f)
+    inv = compute_invariants(load_graph(gfile) if g is None else g)
+    if os.path.exists(gfile):
+        unload_json(inv, inv_file)
+    return inv
+
+
+def decide_homomorphism(inv_g, inv_h):
+    # returns (True, phi), (False, None), or (None, None) if undecided
+    if inv_h['no_nodes'] == 0:
+        return inv_g['no_nodes'] == 0, [] if inv_g['no_nodes'] == 0 else None
+    if inv_g['has_edge'] and not inv_h['has_edge']:
+        return False, None
+    if inv_h['bipartite'] and not inv_g['bipartite']:
+        return False, None
+    if len(inv_g['clique']) > len(inv_h['clique']):
+        return False, None
+    if inv_g['odd_girth'] is not None and inv_h['odd_girth'] is not None \
+            and inv_g['odd_girth'] < inv_h['odd_girth']:
+        return False, None
+    if inv_g['chromatic_number'] > inv_h['chromatic_number']:
+        return False, None
+    if inv_g['chromatic_number'] <= len(inv_h['clique']):
+        # G -> K_chi(G) -> H
+        return True, compose_solutions(inv_g['colouring'], inv_h['clique'])
+    return None, None
@@ -0,0 +1,316 @@
+import os
+import json
+import mmap
+import array
+import struct
+import collections.abc
+
+import networkx as nx
+
+
+# binary lattice database
+#
+# node names are interned: they are stored once, sorted, and everything else
+# refers to them by their index. all arrays are uint32, sections follow the
+# header in this order:
+#
+#   name_offsets    no_names + 1
+#   names           names_size bytes, padded to 4 bytes
+#   nodes           no_nodes            name ids of the core graph nodes
+#   edge_offsets    no_nodes + 1        core graph, CSR over node indices
+#   edge_targets    no_edges
+#   reach           no_nodes * row_words  transitive closure rows
+#   nonedge_offsets no_names + 1        complement graph, CSR over name ids
+#   nonedge_targets no_nonedges
+#   cores           no_cores
+#   class_offsets   no_names + 1        class members, CSR over name ids
+#   class_members   no_members
+#   class_of        no_names            representative of a member or NONE
+#   hash_offsets    no_names + 1        isomorphism hashes, since version 2
+#   hashes          hash_offsets[no_names] bytes, "<wl hash> [<canonical graph6>]"
+MAGIC = b'SHLATTIC'
+VERSION = 2
+HEADER = struct.Struct('<8s9I')
+NONE = 0xffffffff
+
+
+def is_lattice_store(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class LatticeStore:
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self.mm)
+        magic, version, self.no_names, names_size, self.no_nodes, no_edges, \
+            no_nonedges, no_cores, no_members, self.row_words = HEADER.unpack_from(buf)
+        if magic != MAGIC or version not in [1, VERSION]:
+            raise ValueError('%s is not a lattice store of version %d' % (filename, VERSION))
+        self.pos = HEADER.size
+
+        def take_words(n):
+            words = buf[self.pos:self.pos + 4 * n].cast('I')
+            self.pos += 4 * n
+            return words
+
+        self.name_offsets = take_words(self.no_names + 1)
+        self.names = buf[self.pos:self.pos + names_size]
+        self.pos += (names_size + 3) & ~3
+        self.nodes = take_words(self.no_nodes)
+        self.edge_offsets = take_words(self.no_nodes + 1)
+        self.edge_targets = take_words(no_edges)
+        self.reach = take_words(self.no_nodes * self.row_words)
+        self.nonedge_offsets = take_words(self.no_names + 1)
+        self.nonedge_targets = take_words(no_nonedges)
+        self.cores = take_words(no_cores)
+        self.class_offsets = take_words(self.no_names + 1)
+        self.class_members = take_words(no_members)
+        self.class_of = take_words(self.no_names)
+        self.hash_offsets, self.hashes = None, None
+        if version >= 2:
+            self.hash_offsets = take_words(self.no_names + 1)
+            self.hashes = buf[self.pos:self.pos + self.hash_offsets[self.no_names]]
+
+    def name(self, i):
+        return bytes(self.names[self.name_offsets[i]:self.name_offsets[i + 1]]).decode()
+
+    def find(self, nd):
+        # names are sorted, look them up by binary search
+        key = nd.encode()
+        lo, hi = 0, self.no_names
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if bytes(self.names[self.name_offsets[mid]:self.name_offsets[mid + 1]]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.no_names and self.name(lo) == nd:
+            return lo
+        return None
+
+    def get_cores(self):
+        return [self.name(i) for i in self.cores]
+
+    def get_reachability(self):
+        row_size = 4 * self.row_words
+        rows = self.reach.cast('B')
+        ids = {self.name(nd) : i for i, nd in enumerate(self.nodes)}
+        reach = [int.from_bytes(rows[i * row_size:(i + 1) * row_size], 'little') for i in range(self.no_nodes)]
+        return ids, reach
+
+    def get_core_graph(self):
+        names = [self.name(nd) for nd in self.nodes]
+        g = nx.DiGraph()
+        g.add_nodes_from(names)
+        for i in range(self.no_nodes):
+            for j in self.edge_targets[self.edge_offsets[i]:self.edge_offsets[i + 1]]:
+                g.add_edge(names[i], names[j])
+        return g
+
+    def get_nonedges(self, nd):
+        i = self.find(nd)
+        if i is None:
+            return []
+        return [self.name(j) for j in self.nonedge_targets[self.nonedge_offsets[i]:self.nonedge_offsets[i + 1]]]
+
+    def has_nonedge(self, a, b):
+        i, j = self.find(a), self.find(b)
+        if i is None or j is None:
+            return False
+        return j in self.nonedge_targets[self.nonedge_offsets[i]:self.nonedge_offsets[i + 1]]
+
+    def get_nonedge_graph(self, representatives):
+        g = nx.DiGraph()
+        g.add_nodes_from(representatives)
+        for i in range(self.no_names):
+            for j in self.nonedge_targets[self.nonedge_offsets[i]:self.nonedge_offsets[i + 1]]:
+                g.add_edge(self.name(i), self.name(j))
+        return g
+
+    def get_class(self, rpr):
+        i = self.find(rpr)
+        if i is None or self.class_offsets[i] == self.class_offsets[i + 1]:
+            return None
+        return set(self.name(j) for j in self.class_members[self.class_offsets[i]:self.class_offsets[i + 1]])
+
+    def get_class_of(self, nd):
+        i = self.find(nd)
+        if i is None or self.class_of[i] == NONE:
+            return None
+        return self.name(self.class_of[i])
+
+    def iterate_classes(self):
+        for i in range(self.no_names):
+            if self.class_offsets[i] != self.class_offsets[i + 1]:
+                yield self.name(i)
+
+    def iterate_members(self):
+        for i in range(self.no_names):
+            if self.class_of[i] != NONE:
+                yield self.name(i)
+
+    def get_hash(self, nd):
+        i = None if self.hashes is None else self.find(nd)
+        if i is None or self.hash_offsets[i] == self.hash_offsets[i + 1]:
+            return None
+        wl_hash, *certificate = bytes(self.hashes[self.hash_offsets[i]:self.hash_offsets[i + 1]]).decode().split(' ')
+        return [wl_hash, certificate[0] if certificate else None]
+
+    def iterate_hashed(self):
+        if self.hashes is None:
+            return
+        for i in range(self.no_names):
+            if self.hash_offsets[i] != self.hash_offsets[i + 1]:
+                yield self.name(i)
+
+
+class StoreMapping(collections.abc.MutableMapping):
+    # dictionary backed by a store section, values are decoded on first
+    # access and kept in memory together with every change
+    def __init__(self, lookup, iterate_keys):
+        self.lookup = lookup
+        self.iterate_keys = iterate_keys
+        self.overlay = {}
+        self.deleted = set()
+
+    def __getitem__(self, k):
+        if k in self.overlay:
+            return self.overlay[k]
+        value = None if k in self.deleted else self.lookup(k)
+        if value is None:
+            raise KeyError(k)
+        self.overlay[k] = value
+        return value
+
+    def __setitem__(self, k, value):
+        self.overlay[k] = value
+        self.deleted.discard(k)
+
+    def __delitem__(self, k):
+        if k not in self:
+            raise KeyError(k)
+        del self.overlay[k]
+        self.deleted.add(k)
+
+    def __iter__(self):
+        yield from list(self.overlay)
+        for k in self.iterate_keys():
+            if k not in self.overlay and k not in self.deleted:
+                yield k
+
+    def __len__(self):
+        return sum(1 for k in self)
+
+
+def write_lattice_store(lattice, filename):
+    path_finder = lattice.path_finder
+    core_graph, core_graph_c = path_finder.core_graph, path_finder.core_graph_c
+    reachability = path_finder.reachability
+    if reachability.dirty or len(reachability.ids) != core_graph.number_of_nodes():
+        reachability.rebuild()
+    # core graph nodes are written in the order of their reachability ids
+    nodes = [None for nd in reachability.ids]
+    for nd, i in reachability.ids.items():
+        nodes[i] = nd
+
+    names = set(nodes) | set(core_graph_c.nodes()) | set(path_finder.representatives)
+    for rpr in lattice.classes:
+        names.add(rpr)
+        names.update(lattice.classes[rpr])
+    for nd, rpr in lattice.class_index.items():
+        names.update([nd, rpr])
+    names.update(lattice.hashes)
+    names = sorted(names)
+    name_ids = {nd : i for i, nd in enumerate(names)}
+    node_ids = {nd : i for i, nd in enumerate(nodes)}
+
+    encoded = [nd.encode() for nd in names]
+    name_offsets = array.array('I', [0])
+    for s in encoded:
+        name_offsets.append(name_offsets[-1] + len(s))
+    names_blob = b''.join(encoded)
+    names_blob += bytes(-len(names_blob) % 4)
+
+    edge_offsets, edge_targets = array.array('I', [0]), array.array('I')
+    for nd in nodes:
+        edge_targets.extend(sorted(node_ids[nb] for nb in core_graph.successors(nd)))
+        edge_offsets.append(len(edge_targets))
+
+    row_words = (len(nodes) + 31) // 32
+    reach = b''.join(r.to_bytes(4 * row_words, 'little') for r in reachability.reach)
+
+    nonedge_offsets, nonedge_targets = array.array('I', [0]), array.array('I')
+    class_offsets, class_members = array.array('I', [0]), array.array('I')
+    class_of = array.array('I', [NONE for nd in names])
+    for i, nd in enumerate(names):
+        if nd in core_graph_c:
+            nonedge_targets.extend(sorted(name_ids[nb] for nb in core_graph_c.successors(nd)))
+        nonedge_offsets.append(len(nonedge_targets))
+        if nd in lattice.classes:
+            class_members.extend(sorted(name_ids[m] for m in lattice.classes[nd]))
+        class_offsets.append(len(class_members))
+        rpr = lattice.class_index.get(nd)
+        if rpr is not None:
+            class_of[i] = name_ids[rpr]
+    cores = array.array('I', [name_ids[nd] for nd in path_finder.representatives])
+    hash_offsets, hashes = array.array('I', [0]), []
+    for nd in names:
+        if nd in lattice.hashes:
+            hashes.append(' '.join(x for x in lattice.hashes[nd] if x is not None).encode())
+            hash_offsets.append(hash_offsets[-1] + len(hashes[-1]))
+        else:
+            hash_offsets.append(hash_offsets[-1])
+
+    header = HEADER.pack(MAGIC, VERSION, len(names), name_offsets[-1], len(nodes), len(edge_targets),
+                         len(nonedge_targets), len(cores), len(class_members), row_words)
+    # write to a temporary file first, a store that is mapped by a reader is never modified
+    tmp_fname = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmp_fname, 'wb') as f:
+        for section in [header, name_offsets, names_blob, array.array('I', [name_ids[nd] for nd in nodes]),
+                        edge_offsets, edge_targets, reach, nonedge_offsets, nonedge_targets, cores,
+                        class_offsets, class_members, class_of, hash_offsets, b''.join(hashes)]:
+            f.write(section)
+    os.replace(tmp_fname, filename)
+
+
+def read_journal(filename):
+    # the events of a journal and the size of their prefix; a line torn by a
+    # crash ends the journal
+    events, size = [], 0
+    if not os.path.exists(filename):
+        return events, size
+    with open(filename, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                break
+            size += len(line)
+    return events, size
+
+
+class LatticeJournal:
+    # append-only log of the changes made to a lattice since its database
+    # was last written
+    def __init__(self, filename):
+        self.filename = filename
+        events, size = read_journal(filename)
+        self.no_events = len(events)
+        self.f = open(filename, 'ab')
+        self.f.truncate(size)
+
+    def write(self, *event):
+        self.f.write((json.dumps(event) + '\n').encode())
+        self.f.flush()
+        self.no_events += 1
+
+    def clear(self):
+        self.f.truncate(0)
+        self.no_events = 0
+
+    def close(self):
+        self.f.close()
@@ -3,12 +3,13 @@ import sys
 import subprocess
 import pathlib
 import math
-
-from networkx.drawing.nx_agraph import graphviz_layout
-import cairo
+import collections
 
 from graph_utils import *
 from homomorphism_solver import *
+from invariant_utils import *
+from lattice_store import *
+from cache_utils import *
 
 
 def get_graph_size(gfile):
@@ -21,19 +22,138 @@ def get_graph_id(gfile):
     return int(fname.split('_')[2])
 
 
+def load_graph_core(gfile, g=None):
+    core_file = gfile + '.core'
+    g = load_graph(gfile) if g is None else g
+    if os.path.exists(core_file):
+        with open(core_file, 'r') as f:
+            j = json.load(f)
+        embedding = j['embedding']
+        index = {nd : i for i, nd in enumerate(sorted(g.nodes()))}
+        core = compile_graph(g).subgraph([index[nd] for nd in embedding])
+        return core, j['retraction'], embedding
+    core, retraction, embedding = find_core(g)
+    if os.path.exists(gfile):
+        unload_json({'retraction': retraction, 'embedding': embedding}, core_file)
+    return core, retraction, embedding
+
+
+def find_lattice_file():
+    # the binary store, or a lattice.json written before it existed
+    for fname in ['lattice.db', 'lattice.json']:
+        if os.path.exists(fname):
+            return fname
+    return 'lattice.db'
+
+
 def iterate_edges(dval):
     for k in dval:
         for v in dval[k]:
             yield [k, v]
 
 
+class ReachabilityIndex:
+    # transitive closure of a digraph, the nodes reachable from each node
+    # are kept as bits of a python integer
+    def __init__(self, path_finder, ids=None, reach=None):
+        self.path_finder = path_finder
+        if ids is None:
+            self.rebuild()
+            return
+        self.ids, self.reach = ids, reach
+        self.dirty = False
+        self.last_node, self.last_reach = None, None
+
+    @property
+    def g(self):
+        return self.path_finder.core_graph
+
+    def rebuild(self):
+        self.ids = {nd : i for i, nd in enumerate(self.g.nodes())}
+        self.reach = [0 for nd in self.ids]
+        dag = nx.condensation(self.g)
+        scc_reach = {}
+        for c in reversed(list(nx.topological_sort(dag))):
+            bits = 0
+            for nd in dag.nodes[c]['members']:
+                bits |= 1 << self.ids[nd]
+            for succ in dag.successors(c):
+                bits |= scc_reach[succ]
+            scc_reach[c] = bits
+        for nd, c in dag.graph['mapping'].items():
+            self.reach[self.ids[nd]] = scc_reach[c]
+        self.dirty = False
+        # the last added node and the closure before it was added
+        self.last_node, self.last_reach = None, None
+
+    def add_node(self, nd):
+        if self.dirty or nd in self.ids:
+            return
+        self.last_node, self.last_reach = nd, list(self.reach)
+        self.ids[nd] = len(self.reach)
+        self.reach += [1 << self.ids[nd]]
+
+    def add_edge(self, a, b):
+        if self.dirty:
+            return
+        if a not in self.ids or b not in self.ids:
+            self.dirty = True
+            return
+        if self.last_node != a and self.last_node != b:
+            self.last_node, self.last_reach = None, None
+        ia, ib = self.ids[a], self.ids[b]
+        if (self.reach[ia] >> ib) & 1:
+            return
+        bit, reach_b = 1 << ia, self.reach[ib]
+        for i in range(len(self.reach)):
+            if self.reach[i] & bit:
+                self.reach[i] |= reach_b
+
+    def remove_edge(self, a, b):
+        if self.dirty:
+            return
+        nd = self.last_node
+        if nd != a and nd != b:
+            self.dirty = True
+            return
+        # only edges of the last node were added since the snapshot, replay them
+        self.reach = list(self.last_reach) + [1 << self.ids[nd]]
+        for (u, v) in list(self.g.in_edges(nd)) + list(self.g.out_edges(nd)):
+            self.add_edge(u, v)
+
+    def remove_node(self, nd):
+        if self.dirty:
+            return
+        if nd != self.last_node:
+            self.dirty = True
+            return
+        self.reach = self.last_reach
+        del self.ids[nd]
+        self.last_node, self.last_reach = None, None
+
+    def has_path(self, a, b):
+        if self.dirty:
+            self.rebuild()
+        if a not in self.ids or b not in self.ids:
+            return False
+        return bool((self.reach[self.ids[a]] >> self.ids[b]) & 1)
+
+
 class LatticePathFinder:
-    def __init__(self, lattice, g, nonedges, cores):
+    def __init__(self, lattice, g, nonedges, cores, store=None):
         self.lattice = lattice
+        self.store = store
         self.representatives = cores
         self.repr_set = set(self.representatives)
+        if store is not None:
+            # the store was written from a consistent lattice, the graphs
+            # are only built once something needs them
+            self._core_graph, self._core_graph_c = None, None
+            self.reachability = ReachabilityIndex(self, *store.get_reachability())
+            return
         # set core graph and its complement
         self.core_graph = g
+        self.reachability = ReachabilityIndex(self)
         self.core_graph_c = nx.DiGraph()
         self.core_graph_c.add_nodes_from(self.representatives)
         self.core_graph_c.add_edges_from(iterate_edges(nonedges))
@@ -41,11 +161,44 @@ class LatticePathFinder:
         for c in cores:
             self.update_representativeness(c)
 
+    @property
+    def core_graph(self):
+        if self._core_graph is None:
+            self._core_graph = self.store.get_core_graph()
+        return self._core_graph
+
+    @core_graph.setter
+    def core_graph(self, g):
+        self._core_graph = g
+
+    @property
+    def core_graph_c(self):
+        if self._core_graph_c is None:
+            self._core_graph_c = self.store.get_nonedge_graph(self.representatives)
+        return self._core_graph_c
+
+    @core_graph_c.setter
+    def core_graph_c(self, g):
+        self._core_graph_c = g
+
+    def get_nonedges(self, nd):
+        if self._core_graph_c is None:
+            return self.store.get_nonedges(nd)
+        if nd not in self._core_graph_c:
+            return []
+        return list(self._core_graph_c.neighbors(nd))
+
+    def has_nonedge(self, a, b):
+        if self._core_graph_c is None:
+            return self.store.has_nonedge(a, b)
+        return self._core_graph_c.has_edge(a, b)
+
     def add_representative(self, nd):
         self.representatives += [nd]
         self.repr_set.add(nd)
 
         self.core_graph.add_node(nd)
+        self.reachability.add_node(nd)
         # for rpr in self.representatives:
         #     if self.lattice.g.has_edge(rpr, nd):
         #         self.core_graph.add_edge(rpr, nd)
@@ -58,7 +211,9 @@ class LatticePathFinder:
         del self.representatives[index]
         self.repr_set.remove(nd)
         self.core_graph.remove_node(nd)
+        self.reachability.remove_node(nd)
         self.core_graph_c.remove_node(nd)
+        self.lattice.log_event('remove', nd)
 
     def update_representativeness(self, nd):
         should_contain = self.check_representativeness(nd)
@@ -73,9 +228,9 @@ class LatticePathFinder:
         # for nb in self.lattice.g.neighbors(nd):
         #     if self.is_representative(nb):
         #         return nb
-        for rpr in self.representatives:
-            if rpr in self.lattice.classes and nd in self.lattice.classes[rpr]:
-                return rpr
+        rpr = self.lattice.class_index.get(nd)
+        if rpr is not None and self.is_representative(rpr):
+            return rpr
         return nd
 
     def is_representative(self, nd):
@@ -97,16 +252,16 @@ class LatticePathFinder:
     def is_known_homomorphism(self, a, b):
         a = self.get_equivalent_node(a)
         b = self.get_equivalent_node(b)
-        return a == b or self.core_graph.has_edge(a, b) or nx.has_path(self.core_graph, a, b)
+        return a == b or self.reachability.has_path(a, b)
 
     def is_known_non_homomorphism(self, a, b):
         a = self.get_equivalent_node(a)
         b = self.get_equivalent_node(b)
         if a == b:
             return False
-        if self.core_graph_c.has_edge(a, b):
+        if self.has_nonedge(a, b):
             return True
-        for nh in self.core_graph_c.neighbors(a):
+        for nh in self.get_nonedges(a):
             if self.is_known_homomorphism(b, nh):
                 return True
         return False
@@ -120,8 +275,10 @@ class LatticePathFinder:
         a = self.get_equivalent_node(a)
         b = self.get_equivalent_node(b)
         #print('memoized', a, b, relation)
+        self.lattice.log_event('memoize', a, b, relation)
         if relation:
             self.core_graph.add_edge(a, b)
+            self.reachability.add_edge(a, b)
         else:
             self.core_graph_c.add_edge(a, b)
 
@@ -134,7 +291,12 @@ class LatticePathFinder:
         # raise Exception("unexpected scenareo")
         a = self.get_equivalent_node(a)
         b = self.get_equivalent_node(b)
-        return nx.has_path(self.core_graph, a, b)
+        return self.reachability.has_path(a, b)
+
+    def remove_edge(self, a, b):
+        self.core_graph.remove_edge(a, b)
+        self.reachability.remove_edge(a, b)
+        self.lattice.log_event('remove_edge', a, b)
 
     def can_remove_edge(self, a, b):
         #print('trying to remove edge', a, b)
@@ -149,6 +311,11 @@ class LatticeGraphCache:
     def __init__(self, lattice):
         self.lattice = lattice
         self.cache = {}
+        self.recent = collections.OrderedDict()
+        self.recent_size = 1024
+        self.cores = {}
+        self.invariants = {}
+        self.forms = {}
 
     def update(self):
         for fname in list(self.cache.keys()):
@@ -161,31 +328,135 @@ class LatticeGraphCache:
     def load(self, fname):
         if fname in self.cache:
             return self.cache[fname]
-        return load_graph(fname)
+        # graphs that are not representatives are kept in a bounded LRU cache
+        if fname in self.recent:
+            self.recent.move_to_end(fname)
+            return self.recent[fname]
+        # graph6 graphs stay bitset rows: the solver compiles them as they
+        # are, and only the invariants need them as networkx graphs
+        g = load_graph(fname, compact=True)
+        self.recent[fname] = g
+        if len(self.recent) > self.recent_size:
+            self.recent.popitem(last=False)
+        return g
+
+    def load_core(self, fname):
+        # cores are compiled once, they are searched from and into many times
+        if fname not in self.cores:
+            core, retraction, embedding = load_graph_core(fname, self.load(fname))
+            self.cores[fname] = compile_graph(core), retraction, embedding
+        return self.cores[fname]
+
+    def load_invariants(self, fname):
+        if fname not in self.invariants:
+            self.invariants[fname] = load_invariants(fname, self.load(fname))
+        return self.invariants[fname]
+
+    def load_wl_hash(self, fname):
+        return wl_hash(self.load(fname))
+
+    def load_form(self, fname):
+        if fname not in self.forms:
+            self.forms[fname] = canonical_form(self.load(fname))
+        return self.forms[fname]
 
 class Lattice:
-    def __init__(self, g=None, nonedges={}, cores=[], classes={}):
+    def __init__(self, g=None, nonedges=None, cores=None, classes=None, members=None, hashes=None, store=None):
+        self.cache = LatticeGraphCache(self)
+        self.use_cores = True
+        # search node and time limits of a pair, 0 for none. pairs that run
+        # out are postponed, and their objects stay pending
+        self.node_limit = 0
+        self.time_limit = 0
+        # race several solver configurations on every pair
+        self.portfolio = False
+        # persistent results of earlier searches, if enabled
+        self.results = open_homomorphism_cache()
+        self.journal = None
+        # objects whose insertion was interrupted
+        self.pending = set()
+        # node -> [WL hash, canonical graph6 or None], and WL hash -> nodes
+        self.iso_index = None
+        if store is not None:
+            self.classes = StoreMapping(store.get_class, store.iterate_classes)
+            self.class_index = StoreMapping(store.get_class_of, store.iterate_members)
+            self.hashes = StoreMapping(store.get_hash, store.iterate_hashed)
+            self.path_finder = LatticePathFinder(self, None, None, store.get_cores(), store=store)
+            return
         g = nx.DiGraph() if g is None else g
-        self.path_finder = LatticePathFinder(self, g, nonedges, cores)
+        nonedges = {} if nonedges is None else nonedges
+        cores = [] if cores is None else cores
+        classes = {} if classes is None else classes
         self.classes = classes
         for k in classes:
             self.classes[k] = set(classes[k])
-        self.cache = LatticeGraphCache(self)
+        # class member -> representative of its class
+        self.class_index = members
+        if self.class_index is None:
+            self.class_index = {nd : rpr for rpr in self.classes for nd in self.classes[rpr]}
+        self.hashes = {} if hashes is None else hashes
+        self.path_finder = LatticePathFinder(self, g, nonedges, cores)
 
     @staticmethod
     def load(filename):
-        with open(filename, 'r') as f:
-            return deserialize_lattice(f.read())
+        if is_lattice_store(filename):
+            lattice = Lattice(store=LatticeStore(filename))
+        else:
+            with open(filename, 'r') as f:
+                lattice = deserialize_lattice(f.read())
+        lattice.replay_journal(filename)
+        return lattice
 
     def unload(self, filename):
-        with open(filename, 'w') as f:
-            json.dump(serialize_lattice(self), f)
+        if filename.endswith('.json'):
+            unload_json(serialize_lattice(self), filename)
+        else:
+            write_lattice_store(self, filename)
+
+    def open_journal(self, filename):
+        self.journal = LatticeJournal(filename + '.journal')
+
+    def log_event(self, *event):
+        if self.journal is not None:
+            self.journal.write(*event)
+
+    def replay_journal(self, filename):
+        events, _ = read_journal(filename + '.journal')
+        journal, self.journal = self.journal, None
+        for event in events:
+            self.apply_event(*event)
+        self.journal = journal
+
+    def apply_event(self, kind, *args):
+        # events may be applied twice if a compaction was interrupted, so
+        # every one of them has to be idempotent
+        if kind == 'add':
+            if not self.path_finder.is_representative(args[0]):
+                self.path_finder.add_representative(args[0])
+            self.pending.add(args[0])
+        elif kind == 'done':
+            self.pending.discard(args[0])
+        elif kind == 'memoize':
+            self.path_finder.memoize_relation(*args)
+        elif kind == 'remove_edge':
+            if self.path_finder.core_graph.has_edge(*args):
+                self.path_finder.remove_edge(*args)
+        elif kind == 'remove':
+            if self.path_finder.is_representative(args[0]):
+                self.path_finder.remove_representative(args[0])
+        elif kind == 'class':
+            self.add_element_to_class(*args)
+
+    def compact(self, filename):
+        # write the database first: if that is interrupted, the journal is intact
+        self.unload(filename)
+        if self.journal is not None:
+            self.journal.clear()
+            for nd in self.pending:
+                self.log_event('add', nd)
 
     def has_node(self, nd):
-        for rpr in self.classes:
-            if rpr == nd or nd in self.classes[rpr]:
-                return True
-        return False
+        return nd in self.class_index or nd in self.classes or self.path_finder.is_representative(nd)
 
     def class_size(self, nd):
         if nd not in self.classes:
@@ -196,38 +467,156 @@ class Lattice:
         if rpr not in self.classes:
             self.classes[rpr] = set()
         self.classes[rpr].add(nd)
+        self.class_index[nd] = rpr
+        self.log_event('class', rpr, nd)
+
+    def get_iso_index(self):
+        if self.iso_index is None:
+            self.iso_index = {}
+            # hashes of lattices written before they were kept are computed once
+            for nd in list(self.path_finder.representatives) + list(self.class_index):
+                self.add_hash(nd)
+        return self.iso_index
+
+    def add_hash(self, nd):
+        if self.iso_index is None:
+            # building the index hashes every node, this one included
+            self.get_iso_index()
+            return
+        if nd not in self.hashes:
+            self.hashes[nd] = [self.cache.load_wl_hash(nd), None]
+        self.iso_index.setdefault(self.hashes[nd][0], []).append(nd)
+
+    def get_certificate(self, nd):
+        if self.hashes[nd][1] is None:
+            self.hashes[nd][1] = self.cache.load_form(nd)[0]
+        return self.hashes[nd][1]
+
+    def find_isomorphic_node(self, nodename):
+        # WL hashes rule out most candidates, canonical forms confirm the rest
+        candidates = self.get_iso_index().get(self.cache.load_wl_hash(nodename), [])
+        if len(candidates) == 0:
+            return None
+        certificate = self.cache.load_form(nodename)[0]
+        for nd in candidates:
+            if self.get_certificate(nd) == certificate:
+                return nd
+        return None
+
+    def find_homomorphisms_parallel(self, pool, nodename, representatives):
+        pairs = []
+        for other_graph in representatives:
+            if nodename == other_graph:
+                continue
+            for (gfile, hfile) in [(nodename, other_graph), (other_graph, nodename)]:
+                if not self.path_finder.is_known_relation(gfile, hfile):
+                    pairs += [(gfile, hfile, self.use_cores, self.node_limit, self.time_limit, self.portfolio)]
+        results = pool.map(find_homomorphism_worker, pairs)
+        return {(pair[0], pair[1]): result for (pair, result) in zip(pairs, results)}
 
-    def add_object(self, filename):
+    def add_object(self, filename, pool=None):
         nodename = filename
         #print()
         print('adding object', nodename)
-        if self.has_node(nodename):
+        if nodename in self.pending:
+            print('resuming', nodename)
+        elif self.has_node(nodename):
             print('already exists', nodename)
             return
-        self.path_finder.add_representative(nodename)
+        else:
+            equiv = self.find_isomorphic_node(nodename)
+            if equiv is not None:
+                equiv = self.path_finder.get_equivalent_node(equiv)
+                print('isomorphic to', equiv)
+                self.add_element_to_class(equiv, nodename)
+                self.add_hash(nodename)
+                return
+            self.path_finder.add_representative(nodename)
+            self.pending.add(nodename)
+            self.log_event('add', nodename)
+        # an interrupted insertion may have been merged into a class already
+        if self.path_finder.is_representative(nodename):
+            if not self.insert_representative(nodename, pool):
+                # some of its pairs ran out of the search limits, it is
+                # resumed later, when more relations may be known
+                print('postponed', nodename)
+                return
+        self.pending.discard(nodename)
+        self.log_event('done', nodename)
+        if nodename not in self.hashes:
+            self.add_hash(nodename)
+
+    def insert_representative(self, nodename, pool=None):
         self.cache.update()
         sorted_representatives = sorted(self.path_finder.representatives, key=lambda nd: self.class_size(nd), reverse=True)
+        results = {}
+        if pool is not None:
+            # solve every pair that is not known yet in parallel, then memoize
+            # the results in the same order as the sequential search would
+            results = self.find_homomorphisms_parallel(pool, nodename, sorted_representatives)
+        else:
+            # the new node is mapped to all representatives at once, the other
+            # direction is searched as the relations found so far leave it open
+            targets = [nd for nd in sorted_representatives
+                       if nd != nodename and not self.path_finder.is_known_relation(nodename, nd)]
+            for hfile, phi in self.find_homomorphisms_to(nodename, targets).items():
+                results[(nodename, hfile)] = get_answer(phi)
+        complete = True
         for other_graph in sorted_representatives:
             if nodename == other_graph:
                 continue
             #print('\t<?>', other_graph)
-            self.establish_homomorphism(nodename, other_graph)
-            self.establish_homomorphism(other_graph, nodename)
+            for (gfile, hfile) in [(nodename, other_graph), (other_graph, nodename)]:
+                if self.establish_homomorphism(gfile, hfile, results.get((gfile, hfile))) == UNKNOWN:
+                    complete = False
             if self.path_finder.core_graph.has_edge(nodename, other_graph) and self.path_finder.core_graph.has_edge(other_graph, nodename):
                 # we found an equivalence to an existing node
-                for nb in list(self.path_finder.core_graph.neighbors(nodename)):
-                    if nb == other_graph:
-                        continue
-                    self.path_finder.core_graph.remove_edge(nodename, nb)
-                for nb in list(self.path_finder.core_graph.predecessors(nodename)):
-                    if nb == other_graph:
-                        continue
-                    self.path_finder.core_graph.remove_edge(nb, nodename)
-                self.path_finder.remove_representative(nodename)
-                self.add_element_to_class(other_graph, nodename)
+                self.merge_representative(nodename, other_graph)
+                return True
+        return complete
+
+    def merge_representative(self, nodename, other_graph):
+        # the relations of nodename are handed over to the equivalent
+        # other_graph, they may be the only way to some nodes for a node
+        # whose insertion was postponed
+        core_graph, core_graph_c = self.path_finder.core_graph, self.path_finder.core_graph_c
+        successors = [nb for nb in core_graph.successors(nodename) if nb != other_graph]
+        predecessors = [nb for nb in core_graph.predecessors(nodename) if nb != other_graph]
+        nonedges = [(other_graph, nb) for nb in core_graph_c.successors(nodename)]
+        nonedges += [(nb, other_graph) for nb in core_graph_c.predecessors(nodename)]
+        for nb in successors:
+            self.path_finder.remove_edge(nodename, nb)
+        for nb in predecessors:
+            self.path_finder.remove_edge(nb, nodename)
+        for nb in successors:
+            self.path_finder.memoize_relation(other_graph, nb, True)
+        for nb in predecessors:
+            self.path_finder.memoize_relation(nb, other_graph, True)
+        for (a, b) in nonedges:
+            self.path_finder.memoize_relation(a, b, False)
+        self.path_finder.remove_representative(nodename)
+        self.add_element_to_class(other_graph, nodename)
+
+    def resume_pending(self, pool=None, no_rounds=3):
+        # postponed objects are tried again with twice the limits every
+        # round, and without limits in the last one. their pairs are those
+        # the default configuration got stuck on, so they are raced by the
+        # portfolio of configurations
+        node_limit, time_limit, portfolio = self.node_limit, self.time_limit, self.portfolio
+        self.portfolio = True
+        for k in range(no_rounds + 1):
+            if len(self.pending) == 0:
                 break
+            if k < no_rounds:
+                self.node_limit, self.time_limit = 2 * self.node_limit, 2 * self.time_limit
+            else:
+                self.node_limit, self.time_limit = 0, 0
+            for nodename in sorted(self.pending):
+                self.add_object(nodename, pool)
+        self.node_limit, self.time_limit, self.portfolio = node_limit, time_limit, portfolio
 
     def is_homomorphic(self, gfile, hfile):
+        # True or False, or UNKNOWN if the searches it takes run out of the limits
         print('eval %s -> %s' % (gfile, hfile))
         if gfile == hfile:
             return True
@@ -236,46 +625,86 @@ class Lattice:
             if self.path_finder.is_known_relation(gfile, hfile):
                 return self.path_finder.is_known_homomorphism(gfile, hfile)
         elif g_known and not h_known:
-            nonedges = []
             equiv = self.path_finder.get_equivalent_node(gfile)
             # print('found equivalent', equiv)
-            if equiv in self.path_finder.core_graph_c.nodes():
-                nonedges = list(self.path_finder.core_graph_c.neighbors(equiv))
+            nonedges = self.path_finder.get_nonedges(equiv)
             nonedges = [nd for nd in nonedges if get_graph_size(nd) <= get_graph_size(gfile)]
-            for nh in nonedges:
-                print('test %s -> %s' % (nh, hfile))
-                if self.find_homomorphism(nh, hfile) is not None:
-                    return False
+            # G -/-> N and H -> N, hence G -/-> H
+            print('test %s -> %s' % (hfile, ' '.join(nonedges)))
+            if any(get_answer(phi) is True for phi in self.find_homomorphisms_to(hfile, nonedges).values()):
+                return False
         elif not g_known and h_known:
-            return self.find_homomorphism(gfile, self.path_finder.get_equivalent_node(hfile)) is not None
+            return get_answer(self.find_homomorphism(gfile, self.path_finder.get_equivalent_node(hfile)))
         else:
             sorted_cores = self.path_finder.representatives
             g_core_cand = None
+            gc_results = self.find_homomorphisms_to(gfile, sorted_cores)
             for core in sorted_cores:
-                gc_result = self.find_homomorphism(gfile, core) is not None
+                gc_result = get_answer(gc_results[core]) is True
                 if gc_result and (g_core_cand is None or self.path_finder.has_path(g_core_cand, core)):
                     g_core_cand = core
-                    ch_result = self.find_homomorphism(g_core_cand, hfile) is not None
-                    if not ch_result:
-                        return False
-                    hc_result = self.find_homomorphism(hfile, core) is not None
-                    if hc_result:
-                        return self.is_homomorphic(gfile, core)
+                    # G -> C and C -> H, hence G -> H
+                    ch_result = get_answer(self.find_homomorphism(g_core_cand, hfile)) is True
+                    if ch_result:
+                        return True
             if g_core_cand is not None:
-                cg_result = self.find_homomorphism(g_core_cand, gfile) is not None
+                cg_result = get_answer(self.find_homomorphism(g_core_cand, gfile)) is True
                 if cg_result:
                     return self.is_homomorphic(g_core_cand, hfile)
         print('test %s -> %s' % (gfile, hfile))
-        return self.find_homomorphism(gfile, hfile) is not None
+        return get_answer(self.find_homomorphism(gfile, hfile))
 
     def is_homomorphic_eq(self, gfile, hfile):
-        return self.is_homomorphic(gfile, hfile) and self.is_homomorphic(hfile, gfile)
+        result = self.is_homomorphic(gfile, hfile)
+        if result is False:
+            return False
+        other = self.is_homomorphic(hfile, gfile)
+        if other is False:
+            return False
+        return UNKNOWN if UNKNOWN in [result, other] else True
 
     def find_homomorphism(self, gfile, hfile):
-        G, H = self.cache.load(gfile), self.cache.load(hfile)
-        return is_homomorphic(G, H)
-
-    def establish_homomorphism(self, gfile, hfile):
+        return self.find_homomorphisms_to(gfile, [hfile])[hfile]
+
+    def find_homomorphisms_to(self, gfile, hfiles):
+        # find_homomorphism of G for many H: the pairs that the invariants and
+        # the results cache leave open are searched in one go, skipping those
+        # that follow from relations known between the H's. such pairs get
+        # True instead of a map, and pairs beyond the limits UNKNOWN
+        results, unknown = {}, []
+        for hfile in hfiles:
+            decided, phi = decide_homomorphism(self.cache.load_invariants(gfile), self.cache.load_invariants(hfile))
+            if decided is None and self.results is not None:
+                found, phi = self.results.lookup(self.cache.load_form(gfile), self.cache.load_form(hfile))
+                decided = True if found else None
+            if decided is None:
+                unknown.append(hfile)
+            else:
+                results[hfile] = phi
+        if len(unknown) == 0:
+            return results
+
+        def implies(i, j):
+            return self.has_node(unknown[i]) and self.has_node(unknown[j]) \
+                and self.path_finder.is_known_homomorphism(unknown[i], unknown[j])
+
+        if self.use_cores:
+            g_core = self.cache.load_core(gfile)
+            h_cores = [self.cache.load_core(hfile) for hfile in unknown]
+            phis = is_homomorphic_targets(g_core[0], [h_core[0] for h_core in h_cores], implies,
+                                          node_limit=self.node_limit, time_limit=self.time_limit, portfolio=self.portfolio)
+            phis = [phi if phi is None or phi is True or phi == UNKNOWN else lift_core_solution(g_core, h_core, phi)
+                    for phi, h_core in zip(phis, h_cores)]
+        else:
+            phis = is_homomorphic_targets(self.cache.load(gfile), [self.cache.load(hfile) for hfile in unknown], implies,
+                                          node_limit=self.node_limit, time_limit=self.time_limit, portfolio=self.portfolio)
+        for hfile, phi in zip(unknown, phis):
+            results[hfile] = phi
+            if self.results is not None and phi is not True and phi != UNKNOWN:
+                self.results.store(self.cache.load_form(gfile), self.cache.load_form(hfile), phi)
+        return results
+
+    def establish_homomorphism(self, gfile, hfile, result=None):
         if self.path_finder.is_known_relation(gfile, hfile):
             return self.path_finder.is_known_homomorphism(gfile, hfile)
 
@@ -284,8 +713,12 @@ class Lattice:
         assert self.path_finder.is_representative(hfile)
         #print('establish homomorphism', gfile, hfile)
 
-        phi = self.find_homomorphism(gfile, hfile)
-        if phi is None:
+        if result is None:
+            result = get_answer(self.find_homomorphism(gfile, hfile))
+        if result == UNKNOWN:
+            # the pair is searched again when the insertion is resumed
+            return UNKNOWN
+        if not result:
             self.path_finder.memoize_relation(gfile, hfile, False)
             # self.path_finder.update_representativeness(gfile)
             # self.path_finder.update_representativeness(hfile)
@@ -305,6 +738,28 @@ class Lattice:
 
     def transitive_reduction(self):
         self.path_finder.core_graph = nx.transitive_reduction(self.path_finder.core_graph)
+        self.path_finder.reachability = ReachabilityIndex(self.path_finder)
+
+
+def get_answer(phi):
+    # True or False for a result of find_homomorphism, or UNKNOWN
+    if phi == UNKNOWN:
+        return UNKNOWN
+    return phi is not None
+
+
+worker_lattice = None
+
+
+def find_homomorphism_worker(args):
+    global worker_lattice
+    gfile, hfile, use_cores, node_limit, time_limit, portfolio = args
+    if worker_lattice is None:
+        worker_lattice = Lattice()
+    worker_lattice.use_cores = use_cores
+    worker_lattice.node_limit, worker_lattice.time_limit = node_limit, time_limit
+    worker_lattice.portfolio = portfolio
+    return get_answer(worker_lattice.find_homomorphism(gfile, hfile))
 
 
 def serialize_lattice(lattice):
@@ -314,9 +769,9 @@ def serialize_lattice(lattice):
             for u in lattice.path_finder.core_graph_c.nodes()
     }
     j['cores'] = lattice.path_finder.representatives
-    j['classes'] = lattice.classes
-    for k in lattice.classes:
-        j['classes'][k] = list(lattice.classes[k])
+    j['classes'] = {k : list(lattice.classes[k]) for k in lattice.classes}
+    j['members'] = dict(lattice.class_index)
+    j['hashes'] = dict(lattice.hashes)
     return j
 
 
@@ -326,4 +781,6 @@ def deserialize_lattice(s):
     nonedges = j['nonedges']
     cores = j['cores'] if 'cores' in j else []
     classes = j['classes'] if 'classes' in j else {}
-    return Lattice(g, nonedges, cores, classes)
+    members = j['members'] if 'members' in j else None
+    hashes = j['hashes'] if 'hashes' in j else None
+    return Lattice(g, nonedges, cores, classes, members, hashes)
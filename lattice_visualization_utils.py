@@ -6,6 +6,8 @@ import math
 
 from networkx.drawing.nx_agraph import graphviz_layout
 import cairo
+import matplotlib as mpl
+import matplotlib.pyplot as plt
 
 from graph_utils import *
 from homomorphism_solver import *
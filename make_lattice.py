@@ -4,6 +4,8 @@
 import os
 import sys
 import subprocess
+import multiprocessing
+import matplotlib.pyplot as plt
 
 from graph_utils import *
 from lattice_utils import *
@@ -12,17 +14,47 @@ from lattice_visualization_utils import *
 
 if __name__ == '__main__':
     plt.switch_backend('agg')
-    dbfile = './lattice.json'
+    # keep every search result, later runs and other scripts can reuse them
+    os.environ.setdefault('HOMOMORPHISM_CACHE', 'homomorphisms.sqlite')
+    dbfile = './lattice.db'
     lattice = Lattice()
-    if os.path.exists(dbfile):
-        lattice = Lattice.load(dbfile)
+    if os.path.exists(find_lattice_file()):
+        lattice = Lattice.load(find_lattice_file())
+    if not os.path.exists(dbfile):
+        # a build that was interrupted before the database was first written
+        lattice.replay_journal(dbfile)
+    lattice.open_journal(dbfile)
 
-    for graph_file in sys.argv[1:]:
+    # -j N: number of worker processes for the homomorphism searches,
+    # -n N, -t S: search nodes and seconds per pair; objects with pairs that
+    # run out are postponed and retried at the end with more
+    graph_files = sys.argv[1:]
+    options = {'-j' : '1', '-n' : '0', '-t' : '0'}
+    while len(graph_files) > 0 and graph_files[0][:2] in options:
+        if len(graph_files[0]) == 2:
+            options[graph_files[0]], graph_files = graph_files[1], graph_files[2:]
+        else:
+            options[graph_files[0][:2]], graph_files = graph_files[0][2:], graph_files[1:]
+    no_jobs = int(options['-j'])
+    lattice.node_limit, lattice.time_limit = int(options['-n']), float(options['-t'])
+    if graph_files == ['-']:
+        # one graph per line, e.g. from ./graph_corpus.py
+        graph_files = [line.strip() for line in sys.stdin if len(line.strip()) > 0]
+    pool = multiprocessing.Pool(no_jobs) if no_jobs > 1 else None
+
+    # finish the objects an interrupted run was inserting
+    for graph_file in sorted(lattice.pending) + graph_files:
         graph_file = graph_file.replace('./', '')
-        lattice.add_object(graph_file)
+        lattice.add_object(graph_file, pool=pool)
+        if lattice.journal.no_events > 100000:
+            lattice.compact(dbfile)
+    lattice.resume_pending(pool)
+    if pool is not None:
+        pool.close()
+        pool.join()
 
-    if len(sys.argv) > 2:
-        lattice.unload(dbfile)
+    if lattice.journal.no_events > 0:
+        lattice.compact(dbfile)
     lattice.transitive_reduction()
     if len(lattice.path_finder.representatives) > 0:
         export_as_vivagraph(lattice, 'visualizations')
@@ -3,6 +3,8 @@
 
 import sys
 import os
+import matplotlib.pyplot as plt
+
 from graph_utils import *
 from lattice_visualization_utils import graph_label_rename
 
@@ -2,6 +2,7 @@
 
 
 import sys
+import matplotlib.pyplot as plt
 
 from graph_utils import *
 from homomorphism_solver import *
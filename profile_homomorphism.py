@@ -10,6 +10,8 @@ import pyximport
 
 from graph_utils import *
 
+# the solver shows up in the profiles only when it was built with
+# HOMOMORPHISM_SOLVER_PROFILE=1 python setup.py build_ext --inplace
 pyximport.install()
 
 from homomorphism_solver import *
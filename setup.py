@@ -1,6 +1,12 @@
+import os
 from distutils.core import setup
 from Cython.Build import cythonize
 
-ext_modules = cythonize("homomorphism_solver.pyx")
-ext_modules = cythonize(ext_modules, compiler_directives={'language_level' : "3"}, gdb_debug=False)
+# the release build has no tracing hooks, HOMOMORPHISM_SOLVER_PROFILE=1 builds
+# the solver with profiling and line tracing for profile_homomorphism.py
+directives = {'language_level' : "3"}
+if os.environ.get('HOMOMORPHISM_SOLVER_PROFILE', '0') != '0':
+    directives.update({'profile' : True, 'linetrace' : True})
+# force: the generated code depends on the directives, not only on the source
+ext_modules = cythonize("homomorphism_solver.pyx", compiler_directives=directives, force=True, gdb_debug=False)
 setup(ext_modules=ext_modules)
@@ -5,10 +5,14 @@ import sys
 
 from graph_utils import *
 from homomorphism_solver import *
+from invariant_utils import *
+from cache_utils import *
 
 
 if __name__ == '__main__':
     gfile, hfile = sys.argv[1], sys.argv[2]
     G, H = load_graph(gfile), load_graph(hfile)
-    phi = is_homomorphic(G, H)
+    decided, phi = decide_homomorphism(load_invariants(gfile, G), load_invariants(hfile, H))
+    if decided is None:
+        phi = is_homomorphic_cached(open_homomorphism_cache(), G, H)
     print('fail' if phi is None else phi)
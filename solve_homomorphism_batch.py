@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+
+import os
+import sys
+import argparse
+import contextlib
+import multiprocessing
+
+from graph_utils import *
+from lattice_utils import *
+from homomorphism_solver import *
+
+
+lattice = None
+use_lattice = False
+print_map = False
+
+
+def init_worker(dbfile, show_map, node_limit=0, time_limit=0, portfolio=False):
+    global lattice, use_lattice, print_map
+    use_lattice, print_map = dbfile is not None, show_map
+    if use_lattice and dbfile == '':
+        dbfile = find_lattice_file()
+    lattice = Lattice.load(dbfile) if use_lattice else Lattice()
+    lattice.node_limit, lattice.time_limit = node_limit, time_limit
+    lattice.portfolio = portfolio
+
+
+def read_pairs(f):
+    for line in f:
+        line = line.strip()
+        if len(line) == 0 or line.startswith('#'):
+            continue
+        gfile, hfile = line.split()[:2]
+        yield gfile.replace('./', ''), hfile.replace('./', '')
+
+
+def answer_query(pair):
+    gfile, hfile = pair
+    phi = None
+    # the lattice reports its progress on stdout, which is reserved for answers
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if use_lattice:
+            result = lattice.is_homomorphic(gfile, hfile)
+            if result is True and print_map:
+                phi = lattice.find_homomorphism(gfile, hfile)
+        else:
+            phi = lattice.find_homomorphism(gfile, hfile)
+            result = get_answer(phi)
+    answer = '%s %s %s' % (gfile, hfile, UNKNOWN if result == UNKNOWN else 'YES' if result else 'NO')
+    if print_map and phi is not None and phi != UNKNOWN:
+        answer += ' ' + str(phi)
+    return answer
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='answer many homomorphism queries "gfile hfile", one per line')
+    parser.add_argument('pairs', nargs='?', default='-', help='file with the queries (default: stdin)')
+    parser.add_argument('--lattice', nargs='?', const='', default=None, help='use lattice database (default: lattice.db)')
+    parser.add_argument('--map', action='store_true', help='print the homomorphism for YES answers')
+    parser.add_argument('-j', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--node-limit', type=int, default=0, help='search nodes per query, UNKNOWN beyond (default: no limit)')
+    parser.add_argument('--time-limit', type=float, default=0, help='seconds of search per query, UNKNOWN beyond (default: no limit)')
+    parser.add_argument('--portfolio', action='store_true', help='race several solver configurations on every query')
+    args = parser.parse_args()
+
+    f = sys.stdin if args.pairs == '-' else open(args.pairs, 'r')
+    pairs = read_pairs(f)
+    if args.j > 1:
+        with multiprocessing.Pool(args.j, initializer=init_worker, initargs=(args.lattice, args.map, args.node_limit, args.time_limit, args.portfolio)) as pool:
+            for answer in pool.imap(answer_query, pairs):
+                print(answer, flush=True)
+    else:
+        init_worker(args.lattice, args.map, args.node_limit, args.time_limit, args.portfolio)
+        for answer in map(answer_query, pairs):
+            print(answer, flush=True)
+    if f is not sys.stdin:
+        f.close()
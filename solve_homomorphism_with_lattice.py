@@ -10,6 +10,6 @@ from homomorphism_solver import *
 
 if __name__ == '__main__':
     gfile, hfile = sys.argv[1], sys.argv[2]
-    lattice = Lattice.load('lattice.json')
+    lattice = Lattice.load(find_lattice_file())
     result = lattice.is_homomorphic(gfile, hfile)
     print('YES' if result else 'NO')